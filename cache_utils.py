@@ -0,0 +1,364 @@
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+
+for_encoding = 'é'
+SECONDS_PER_HOUR = 60 * 60
+SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
+
+
+class LabelCache:
+    """
+    Persistent cache of Wikidata labels, keyed by (Wikidata identifier, language) and stored in SQLite.
+    Entries expire after ttl_days and the least recently used entries are evicted
+    when the cache contains more than max_entries entries.
+    """
+
+    def __init__(self, path, ttl_days=30, max_entries=1000000):
+        """
+        :param str path: path of the SQLite database, e.g., resources/label_cache.sqlite
+        :param float ttl_days: number of days after which a label is fetched again
+        :param int max_entries: maximum number of labels in the cache
+        """
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self.path = path
+        self.ttl = ttl_days * SECONDS_PER_DAY
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS labels (
+                                           wd_id TEXT,
+                                           language TEXT,
+                                           label TEXT,
+                                           created REAL,
+                                           last_used REAL,
+                                           PRIMARY KEY (wd_id, language))""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS labels_last_used ON labels (last_used)")
+
+    def get_many(self, wd_ids, language='en'):
+        """
+        :param iterable wd_ids: Wikidata identifiers, e.g., ['Q31', 'Q55']
+        :param str language: language of the labels
+
+        :rtype: dict
+        :return: identifier -> label, for the identifiers with a label in the cache that did not expire
+        """
+        wd_ids = list(wd_ids)
+        now = time.time()
+        wd_id2label = {}
+
+        with self.lock, self.connection:
+            for wd_id in wd_ids:
+                row = self.connection.execute("SELECT label FROM labels WHERE wd_id = ? AND language = ? AND created >= ?",
+                                              (wd_id, language, now - self.ttl)).fetchone()
+                if row is not None:
+                    wd_id2label[wd_id] = row[0]
+
+            self.connection.executemany("UPDATE labels SET last_used = ? WHERE wd_id = ? AND language = ?",
+                                        [(now, wd_id, language) for wd_id in wd_id2label])
+
+            self.hits += len(wd_id2label)
+            self.misses += len(wd_ids) - len(wd_id2label)
+
+        return wd_id2label
+
+    def put_many(self, wd_id2label, language='en'):
+        """
+        Add labels to the cache and evict the least recently used labels if the cache is full.
+
+        :param dict wd_id2label: identifier -> label
+        :param str language: language of the labels
+        """
+        now = time.time()
+
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO labels VALUES (?, ?, ?, ?, ?)",
+                                        [(wd_id, language, label, now, now)
+                                         for wd_id, label in wd_id2label.items()])
+
+            num_entries, = self.connection.execute("SELECT COUNT(*) FROM labels").fetchone()
+            if num_entries > self.max_entries:
+                self.connection.execute("""DELETE FROM labels WHERE rowid IN
+                                           (SELECT rowid FROM labels ORDER BY last_used LIMIT ?)""",
+                                        (num_entries - self.max_entries,))
+
+    def stats(self):
+        """
+        :rtype: str
+        :return: number of hits and misses since the cache was opened
+        """
+        return f'label cache {self.path}: {self.hits} hits, {self.misses} misses'
+
+
+class CrawlStore:
+    """
+    Persistent store of the results of crawling urls (see crawl_utils.fetch_with_newsplease), stored in SQLite.
+    For every url, the status, the Wayback Machine uri, the newsplease information (pickled and compressed with zlib),
+    the time of the first crawl, and the time of the last crawl are stored.
+    Whether a stored result is used again depends on its status: e.g., a successful crawl can be used forever,
+    while a crawl that failed because of a connection error is repeated the next day.
+    """
+
+    def __init__(self, path, revalidate_after_days=None):
+        """
+        :param str path: path of the SQLite database, e.g., resources/crawl_store.sqlite
+        :param dict revalidate_after_days: status -> number of days after which a url with this status
+        is crawled again (None: never). The key "default" is used for the statuses that are not included.
+        """
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        if revalidate_after_days is None:
+            revalidate_after_days = {'default': 1}
+
+        self.path = path
+        self.revalidate_after_days = revalidate_after_days
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS crawls (
+                                           url TEXT PRIMARY KEY,
+                                           status TEXT,
+                                           wayback_uri TEXT,
+                                           news_please_info BLOB,
+                                           first_crawled REAL,
+                                           last_checked REAL)""")
+
+    def is_due(self, status, last_checked):
+        """
+        :rtype: bool
+        :return: whether a url with this status that was last crawled at this time should be crawled again
+        """
+        max_age_days = self.revalidate_after_days.get(status, self.revalidate_after_days.get('default'))
+        if max_age_days is None:
+            return False
+        return time.time() - last_checked > max_age_days * SECONDS_PER_DAY
+
+    def contains(self, url):
+        """
+        :rtype: bool
+        :return: whether the url has been crawled and should not be crawled again (does not count as hit or miss)
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT status, last_checked FROM crawls WHERE url = ?", (url,)).fetchone()
+        return row is not None and not self.is_due(*row)
+
+    def get(self, url):
+        """
+        :rtype: tuple or None
+        :return: (status, Wayback Machine uri, dict with all NewsPlease information or None)
+        or None if the url has not been crawled or should be crawled again
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT status, wayback_uri, news_please_info, last_checked FROM crawls WHERE url = ?",
+                                          (url,)).fetchone()
+
+            if row is None or self.is_due(row[0], row[3]):
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        status, wayback_uri, news_please_info, last_checked = row
+        if news_please_info is not None:
+            news_please_info = pickle.loads(zlib.decompress(news_please_info))
+        return status, wayback_uri, news_please_info
+
+    def put(self, url, status, wayback_uri, news_please_info):
+        """
+        Store the result of crawling a url. The time of the first crawl of the url is kept.
+        """
+        if news_please_info is not None:
+            news_please_info = zlib.compress(pickle.dumps(news_please_info))
+
+        with self.lock, self.connection:
+            now = time.time()
+            self.connection.execute("""INSERT OR REPLACE INTO crawls VALUES
+                                       (?, ?, ?, ?, COALESCE((SELECT first_crawled FROM crawls WHERE url = ?), ?), ?)""",
+                                    (url, status, wayback_uri, news_please_info, url, now, now))
+
+    def stats(self):
+        """
+        :rtype: str
+        :return: number of hits and misses since the store was opened
+        """
+        return f'crawl store {self.path}: {self.hits} hits, {self.misses} misses'
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of SPARQL responses.
+    A response is stored as a gzipped JSON file, whose name is the SHA-256 hash of the endpoint and the query.
+    """
+
+    def __init__(self, folder, max_age_hours=24, refresh=False):
+        """
+        :param str folder: folder in which the responses are stored, e.g., resources/sparql_cache
+        :param float max_age_hours: cached responses older than this are ignored
+        :param bool refresh: if True, cached responses are ignored (and overwritten)
+        """
+        os.makedirs(folder, exist_ok=True)
+
+        self.folder = folder
+        self.max_age = max_age_hours * SECONDS_PER_HOUR
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+
+    def get_path(self, url, query):
+        """
+        :rtype: str
+        :return: path of the cached response of a query, e.g., resources/sparql_cache/3f/3fa5....json.gz
+        """
+        key = hashlib.sha256(f'{url}\n{query}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, key[:2], f'{key}.json.gz')
+
+    def is_usable(self, path):
+        """
+        :rtype: bool
+        :return: whether the cached response at path exists and is recent enough
+        """
+        if any([self.refresh,
+                not os.path.exists(path),
+                os.path.exists(path) and time.time() - os.path.getmtime(path) > self.max_age]):
+            self.misses += 1
+            return False
+
+        self.hits += 1
+        return True
+
+    def get(self, url, query):
+        """
+        :rtype: dict or None
+        :return: the cached response or None if there is no cached response that is recent enough
+        """
+        path = self.get_path(url, query)
+        if not self.is_usable(path):
+            return None
+
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as infile:
+                response = json.load(infile)
+        except (OSError, EOFError, ValueError) as e: # truncated or corrupt file
+            print(e, 'corrupt cached response, removing it')
+            self.remove(url, query)
+            return None
+        return response
+
+    def open(self, url, query):
+        """
+        Open a cached response, such that it can be parsed incrementally.
+
+        :rtype: gzip.GzipFile or None
+        :return: binary file object of the cached response
+        or None if there is no cached response that is recent enough
+        """
+        path = self.get_path(url, query)
+        if not self.is_usable(path):
+            return None
+
+        return gzip.open(path, 'rb')
+
+    def remove(self, url, query):
+        """
+        Remove the cached response of a query, e.g., if it can not be parsed.
+        """
+        path = self.get_path(url, query)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def put(self, url, query, response):
+        """
+        Store the response of a query.
+        """
+        path = self.get_path(url, query)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as outfile:
+            json.dump(response, outfile)
+        os.replace(tmp_path, path)
+
+    def open_writer(self, url, query):
+        """
+        Store the response of a query while it is being received (see class ResponseWriter).
+
+        :rtype: ResponseWriter
+        """
+        return ResponseWriter(self.get_path(url, query))
+
+    def stats(self):
+        """
+        :rtype: str
+        :return: number of hits and misses since the cache was opened
+        """
+        return f'SPARQL response cache {self.folder}: {self.hits} hits, {self.misses} misses'
+
+
+class ResponseWriter:
+    """
+    Writes the raw bytes of a response to a temporary file of the cache.
+    Only after commit is called, the response is available in the cache,
+    hence a response of which the transfer failed is never cached.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        self.outfile = gzip.open(self.tmp_path, 'wb')
+
+    def write(self, data):
+        self.outfile.write(data)
+
+    def commit(self):
+        self.outfile.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        """
+        Remove the temporary file (has no effect after commit).
+        """
+        self.outfile.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class TeeReader:
+    """
+    File-like object that passes everything that is read from a stream to a writer,
+    e.g., to cache a response while it is being parsed.
+    """
+
+    def __init__(self, stream, writer):
+        self.stream = stream
+        self.writer = writer
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.writer.write(data)
+        return data
+
+    def read_remainder(self, chunk_size=65536):
+        """
+        Read the rest of the stream, e.g., after a parser has stopped before the end of the stream.
+        """
+        while self.read(chunk_size):
+            pass
@@ -271,12 +271,14 @@ class Incident:
                 wdt_id,
                 reference_texts=[],
                 extra_info={},
-                direct_types=set()):
+                direct_types=set(),
+                signature=''):
         self.incident_type=incident_type
         self.wdt_id=wdt_id
         self.reference_texts=reference_texts
         self.extra_info=extra_info
         self.direct_types=direct_types
+        self.signature=signature # see utils.get_incident_signature
 
 class ReferenceText:
 
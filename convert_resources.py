@@ -0,0 +1,72 @@
+"""
+Convert MWEP resources to formats that support random access
+
+Usage:
+  convert_resources.py --config_path=<config_path>\
+   --resources=<resources>\
+   --verbose=<verbose>
+
+Options:
+    --config_path=<config_path>
+    --resources=<resources> resources to convert separated by -, supported: "page_store" | "title_index" | "langlinks_index"
+    --verbose=<verbose> 0 --> no stdout 1 --> general stdout 2 --> detailed stdout
+
+Example:
+    python convert_resources.py --config_path="config/mwep_settings.json"\
+    --resources="page_store-title_index-langlinks_index"\
+    --verbose=1
+"""
+import json
+import os
+import pickle
+import time
+
+import disk_index_utils
+import page_store_utils
+import utils
+
+for_encoding = 'é'
+
+if __name__ == '__main__':
+    from docopt import docopt
+
+    start = time.time()
+
+    arguments = docopt(__doc__)
+    print()
+    print('PROVIDED ARGUMENTS')
+    print(arguments)
+    print()
+
+    mwep_settings = json.load(open(arguments['--config_path']))
+    resources = arguments['--resources'].split('-')
+    verbose = int(arguments['--verbose'])
+
+    wiki_folder = mwep_settings['wiki_folder']
+
+    if {'page_store', 'title_index'} & set(resources):
+        path_uri2path_info = os.path.join(wiki_folder, 'page2path.p')
+        with open(path_uri2path_info, 'rb') as infile:
+            wiki_uri2path_info = pickle.load(infile)  # make take some time
+
+    if 'page_store' in resources:
+        page_store_utils.convert_wiki_folder(wiki_folder,
+                                             wiki_uri2path_info,
+                                             verbose=verbose)
+
+    if 'title_index' in resources:
+        disk_index_utils.build_title_index(wiki_uri2path_info,
+                                           os.path.join(wiki_folder, disk_index_utils.TITLE_INDEX_BASENAME),
+                                           verbose=verbose)
+
+    if 'langlinks_index' in resources:
+        wiki_langlinks_path = mwep_settings['wiki_langlinks_path']
+        with open(wiki_langlinks_path, 'rb') as infile:
+            wiki_langlinks = pickle.load(infile)
+
+        disk_index_utils.build_langlinks_index(wiki_langlinks,
+                                               disk_index_utils.get_sst_path(wiki_langlinks_path),
+                                               verbose=verbose)
+
+    end = time.time()
+    print('Conversion done. Time needed', utils.format_time(end - start), 'sec')
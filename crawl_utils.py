@@ -1,8 +1,11 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import urllib
 import http
-import ast
+import json
 import socket
+import threading
+import time
 from urllib.parse import urlencode
 import urllib3
 
@@ -15,7 +18,40 @@ import lxml
 for_encoding = 'é'
 WAYBACK_CDX_SERVER = 'http://web.archive.org/cdx/search/cdx?'
 
+
+class RateLimiter:
+    """
+    Limit the number of requests per second, shared by all threads.
+    """
+
+    def __init__(self, requests_per_second):
+        """
+        :param float requests_per_second: if 0 or None, there is no limit
+        """
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the next request is allowed.
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+wayback_rate_limiter = RateLimiter(None) # limits all requests to web.archive.org (CDX server and snapshots)
+wayback_pool = urllib3.PoolManager(maxsize=10) # connections to the CDX server, shared by all threads
+WAYBACK_CDX_RETRIES = 2
+
+
 def generate_wayback_uri(url,
+                         timeout=None,
                          last_n=-5,
                          format='json',
                          verbose=0):
@@ -24,13 +60,14 @@ def generate_wayback_uri(url,
     API to obtain the last snapshots of the wayback machine for a specific URL.
 
     :param str url: a URL
+    :param int timeout: if provided, timeout in seconds of a request to the CDX server
+    (a request is retried WAYBACK_CDX_RETRIES times)
     :param int last_n: -5 indicates the 5 latest snapshots and 5 the first 5 snapshots
     :param str format: supported: 'json'
 
     :rtype: tuple
     :return: (status, URL or None)
     """
-    http = urllib3.PoolManager()
     wb_url = None
 
     params = {'url': url,
@@ -38,22 +75,25 @@ def generate_wayback_uri(url,
               'limit' : last_n}
 
     encoded_uri = WAYBACK_CDX_SERVER + urlencode(params)
+    wayback_rate_limiter.wait()
     try:
-        r = http.request('GET', encoded_uri)
-    except urllib3.exceptions.MaxRetryError:
+        r = wayback_pool.request('GET',
+                                 encoded_uri,
+                                 timeout=urllib3.Timeout(total=timeout),
+                                 retries=urllib3.Retry(total=WAYBACK_CDX_RETRIES))
+    except urllib3.exceptions.HTTPError: # e.g., MaxRetryError after timeouts
         return 'http request failed', url
 
     if r.status != 200:
-        status = 'status code not 200'
         if verbose >= 4:
             print(f'status code: {r.status}')
+        return 'status code not 200', None
 
-    data_as_string = r.data.decode('utf-8')
     try:
-        snapshots = ast.literal_eval(data_as_string[:-1])
-    except:
+        snapshots = json.loads(r.data.decode('utf-8'))
+    except ValueError:
         # org.archive.util.io.RuntimeIOException: org.archive.wayback.exception.AdministrativeAccessControlException: Blocked Site Error
-        snapshots = ['']
+        snapshots = []
 
     for (urlkey,
          timestamp,
@@ -82,62 +122,61 @@ def generate_wayback_uri(url,
     return status, wb_url
 
 
-def run_newsplease(url,
-                   timeout,
-                   startswith=None,
-                   accepted_languages=set(),
-                   excluded_domains=set(),
-                   title_required=True,
-                   num_chars_range=False,
-                   illegal_substrings=[],
-                   illegal_chars_in_title=set(),
-                   verbose=0):
+def prefetch_wayback_uris(urls, timeout=None, num_workers=1, verbose=0):
     """
-    apply newsplease on a url
+    obtain the Wayback Machine URIs of a batch of urls (see function "generate_wayback_uri"),
+    num_workers lookups at the same time, such that the latency of the CDX server is not paid per url
+    when the urls are crawled.
+
+    :param list urls: urls that are not Wayback Machine snapshots
+    :param int timeout: timeout in seconds of a request to the CDX server
+    :param int num_workers: number of lookups at the same time
+
+    :rtype: dict
+    :return: url -> (status, URL or None)
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        results = executor.map(lambda url: generate_wayback_uri(url, timeout=timeout, verbose=verbose), urls)
+        return dict(zip(urls, results))
+
+
+crawl_store = None # if set to a cache_utils.CrawlStore, the results of fetch_with_newsplease are stored and reused
+
+
+def fetch_with_newsplease(url, timeout, wayback=None, verbose=0):
+    """
+    obtain the Wayback Machine snapshot of a url and apply newsplease on it
+
+    All requests are sent to web.archive.org (CDX server and snapshots), hence they are limited by wayback_rate_limiter.
 
     :param str url: a url to crawl
     :param int timeout: timeout in seconds
-    :param startswith: if provided, the url has to start with this prefix, e.g., http
-    :param set accepted_languages: set of languages that are accepted
-    (https://en.wikipedia.org/wiki/ISO_639-1)
-    :param bool title_required: the article.title value can not be None
-    :param num_chars_range: if of type range, an article will only be included
-    if the number of characters falls within the specified range.
-    :param set illegal_substrings: if an article contains any of these substrings,
-    do not include them
+    :param tuple wayback: if provided, the output of generate_wayback_uri for the url (see prefetch_wayback_uris)
 
     :rtype: tuple
-    :return (status, None of dict with all NewsPlease information)
+    :return: (status, Wayback Machine URL or None, None or dict with all NewsPlease information)
     """
-    status = 'succes'
-    wb_url = None
     news_please_info = None
 
-    if startswith:
-        if not url.startswith(startswith):
-            status = 'not a valid url'
-
-    for excluded_domain in excluded_domains:
-        if excluded_domain in url:
-            status = 'excluded domain'
-
-    if status == 'succes':
-        if 'web.archive.org/web/' not in url:
-            status, wb_url = generate_wayback_uri(url, verbose=verbose)
-        else:
-            status = 'succes'
-            wb_url = url
-
-    # TODO: what if url is not the same as the one crawler (via redirects?)
+    if wayback is not None:
+        status, wb_url = wayback
+    elif 'web.archive.org/web/' not in url:
+        status, wb_url = generate_wayback_uri(url, timeout=timeout, verbose=verbose)
+    else:
+        status = 'succes'
+        wb_url = url
 
     if status == 'succes':
         try:
+            wayback_rate_limiter.wait()
             article = NewsPlease.from_url(wb_url, timeout=timeout)
 
             if article is None:
                 status = 'crawl error'
             elif article.text is None:
                 status = 'crawl error'
+            else:
+                news_please_info = article.get_dict()
 
         except (urllib.error.URLError,
                 ValueError,
@@ -149,48 +188,141 @@ def run_newsplease(url,
                 lxml.etree.ParserError,
                 langdetect.lang_detect_exception.LangDetectException
                 ) as e:
-            article = None
             status = 'URL error'
+        except Exception as e: # e.g., errors of the HTTP libraries that newsplease uses
+            if verbose >= 3:
+                print(f'crawl error for {wb_url}: {e}')
+            status = 'crawl error'
 
-    if status == 'succes':
+    return status, wb_url, news_please_info
+
+
+def validate_newsplease_info(news_please_info,
+                             accepted_languages=set(),
+                             title_required=True,
+                             num_chars_range=False,
+                             illegal_substrings=[],
+                             illegal_chars_in_title=set()):
+    """
+    validate the attributes of a crawled article based on the settings
 
-        # validate attributes based on settings
-        news_please_info = article.get_dict()
+    :param dict news_please_info: output of fetch_with_newsplease
 
-        if accepted_languages:
-            if news_please_info['language'] not in accepted_languages:
-                status = 'not in accepted languages'
+    :rtype: str
+    :return: status ('succes' if the article is accepted)
+    """
+    status = 'succes'
 
-        for illegal_substring in illegal_substrings:
-            if illegal_substring in news_please_info['text']:
-                status = 'illegal substring'
+    if accepted_languages:
+        if news_please_info['language'] not in accepted_languages:
+            status = 'not in accepted languages'
 
-        if num_chars_range:
-            num_chars = len(news_please_info['text'])
-            if num_chars not in num_chars_range:
-                status = 'outside of accepted number of characters range'
+    for illegal_substring in illegal_substrings:
+        if illegal_substring in news_please_info['text']:
+            status = 'illegal substring'
 
-        if title_required:
-            if news_please_info['title'] is None:
-                status = 'no title'
-            else:
-                for illegal_char_in_title in illegal_chars_in_title:
-                    if illegal_char_in_title in news_please_info['title']:
-                        status = 'illegal char in title'
+    if num_chars_range:
+        num_chars = len(news_please_info['text'])
+        if num_chars not in num_chars_range:
+            status = 'outside of accepted number of characters range'
+
+    if title_required:
+        if news_please_info['title'] is None:
+            status = 'no title'
+        else:
+            for illegal_char_in_title in illegal_chars_in_title:
+                if illegal_char_in_title in news_please_info['title']:
+                    status = 'illegal char in title'
+
+    return status
+
+
+def check_url(url, startswith=None, excluded_domains=set()):
+    """
+    check whether a url should be crawled
+
+    :rtype: str
+    :return: status ('succes' if the url should be crawled)
+    """
+    status = 'succes'
+
+    if startswith:
+        if not url.startswith(startswith):
+            status = 'not a valid url'
+
+    for excluded_domain in excluded_domains:
+        if excluded_domain in url:
+            status = 'excluded domain'
+
+    return status
+
+
+def run_newsplease(url,
+                   timeout,
+                   startswith=None,
+                   accepted_languages=set(),
+                   excluded_domains=set(),
+                   title_required=True,
+                   num_chars_range=False,
+                   illegal_substrings=[],
+                   illegal_chars_in_title=set(),
+                   wayback=None,
+                   verbose=0):
+    """
+    apply newsplease on a url
+
+    :param str url: a url to crawl
+    :param int timeout: timeout in seconds
+    :param startswith: if provided, the url has to start with this prefix, e.g., http
+    :param set accepted_languages: set of languages that are accepted
+    (https://en.wikipedia.org/wiki/ISO_639-1)
+    :param bool title_required: the article.title value can not be None
+    :param num_chars_range: if of type range, an article will only be included
+    if the number of characters falls within the specified range.
+    :param set illegal_substrings: if an article contains any of these substrings,
+    do not include them
+    :param tuple wayback: see function "fetch_with_newsplease"
+
+    If crawl_store is set, a url is only fetched if it is not in the store or if its stored result is due
+    for revalidation. The validation is always done again, since the settings can differ between runs.
+
+    :rtype: tuple
+    :return (status, None of dict with all NewsPlease information)
+    """
+    wb_url = None
+    news_please_info = None
+
+    status = check_url(url, startswith=startswith, excluded_domains=excluded_domains)
+
+    if status == 'succes':
+        stored = crawl_store.get(url) if crawl_store is not None else None
+        if stored is not None:
+            status, wb_url, news_please_info = stored
+        else:
+            status, wb_url, news_please_info = fetch_with_newsplease(url, timeout, wayback=wayback, verbose=verbose)
+            if crawl_store is not None:
+                crawl_store.put(url, status, wb_url, news_please_info)
+
+    if status == 'succes':
+        status = validate_newsplease_info(news_please_info,
+                                          accepted_languages=accepted_languages,
+                                          title_required=title_required,
+                                          num_chars_range=num_chars_range,
+                                          illegal_substrings=illegal_substrings,
+                                          illegal_chars_in_title=illegal_chars_in_title)
 
     if verbose >= 3:
         if status == 'succes':
             print()
             print(f'{status} {url}')
-            if status == 'succes':
-                attrs = ['title',
-                         'url',
-                         'date_publish',
-                         'source_domain',
-                         'language']
+            attrs = ['title',
+                     'url',
+                     'date_publish',
+                     'source_domain',
+                     'language']
 
             for attr in attrs:
-                print(f'ATTR {attr}: {getattr(article, attr)}')
+                print(f'ATTR {attr}: {news_please_info[attr]}')
 
             print('num chars', len(news_please_info['text']))
         else:
@@ -216,10 +348,13 @@ def get_ref_text_obj_of_primary_reference_texts(urls,
                                                 num_chars_range=False,
                                                 illegal_substrings=[],
                                                 illegal_chars_in_title=set(),
+                                                num_workers=1,
                                                 verbose=0):
     """
     crawl urls using newsplease and represent succesful crawls
-    using the classes.ReferenceText object
+    using the classes.ReferenceText object.
+    The Wayback Machine URIs of the urls are obtained first (see function "prefetch_wayback_uris"),
+    after which the urls are crawled by num_workers threads (the requests to web.archive.org are limited by wayback_rate_limiter).
 
     :param urls:
     :param timeout: see function "run_newsplease"
@@ -228,6 +363,7 @@ def get_ref_text_obj_of_primary_reference_texts(urls,
     :param excluded_domains: see function "run_newsplease"
     :param title_required: see function "run_newsplease"
     :param num_chars_range: see function "run_newsplease"
+    :param int num_workers: number of urls that are crawled at the same time
 
     :rtype: dict
     :return: mapping from uri ->
@@ -236,23 +372,35 @@ def get_ref_text_obj_of_primary_reference_texts(urls,
     url_to_info = {}
     stati = defaultdict(int)
 
-    for index, url in enumerate(urls, 1):
-
-        if verbose >= 5:
-            if index == 50:
-                print(f'QUITTING AFTER 5 BECAUSE VERBOSE == 50')
-                break
-
-        status, result = run_newsplease(url,
-                                        timeout=timeout,
-                                        startswith=startswith,
-                                        excluded_domains=excluded_domains,
-                                        accepted_languages=accepted_languages,
-                                        title_required=title_required,
-                                        num_chars_range=num_chars_range,
-                                        illegal_substrings=illegal_substrings,
-                                        illegal_chars_in_title=illegal_chars_in_title,
-                                        verbose=verbose)
+    urls = list(urls)
+    if verbose >= 5:
+        if len(urls) >= 50:
+            print(f'QUITTING AFTER 5 BECAUSE VERBOSE == 50')
+            urls = urls[:49]
+
+    to_resolve = [url for url in urls
+                  if check_url(url, startswith=startswith, excluded_domains=excluded_domains) == 'succes'
+                  and 'web.archive.org/web/' not in url
+                  and (crawl_store is None or not crawl_store.contains(url))]
+    url_to_wayback = prefetch_wayback_uris(to_resolve, timeout=timeout, num_workers=num_workers, verbose=verbose)
+
+    def crawl(url):
+        return run_newsplease(url,
+                              timeout=timeout,
+                              startswith=startswith,
+                              excluded_domains=excluded_domains,
+                              accepted_languages=accepted_languages,
+                              title_required=title_required,
+                              num_chars_range=num_chars_range,
+                              illegal_substrings=illegal_substrings,
+                              illegal_chars_in_title=illegal_chars_in_title,
+                              wayback=url_to_wayback.get(url),
+                              verbose=verbose)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        results = list(executor.map(crawl, urls))
+
+    for url, (status, result) in zip(urls, results):
 
         info = {
             'status' : status,
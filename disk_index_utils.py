@@ -0,0 +1,272 @@
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+
+for_encoding = 'é'
+MAGIC = b'MWEPSST1'
+HEADER_FORMAT = '<8sQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+OFFSET_FORMAT = '<Q'
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+RECORD_HEADER_FORMAT = '<II'
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FORMAT)
+TITLE_INDEX_BASENAME = 'page2path.sst'
+SST_EXTENSION = '.sst'
+
+
+def write_sorted_string_table(path, items, verbose=0):
+    """
+    Write key-value pairs to a sorted string table (see class SortedStringTable).
+
+    The file consists of:
+    1. a header with the number of records
+    2. the byte offsets of the records, sorted by key
+    3. the records: key length, value length, key, value
+
+    :param str path: path of the table
+    :param iterable items: iterable of (key, value) tuples, both of type bytes
+    """
+    items = sorted(items)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as outfile:
+        outfile.write(struct.pack(HEADER_FORMAT, MAGIC, len(items)))
+
+        offset = HEADER_SIZE + len(items) * OFFSET_SIZE
+        for key, value in items:
+            outfile.write(struct.pack(OFFSET_FORMAT, offset))
+            offset += RECORD_HEADER_SIZE + len(key) + len(value)
+
+        for key, value in items:
+            outfile.write(struct.pack(RECORD_HEADER_FORMAT, len(key), len(value)))
+            outfile.write(key)
+            outfile.write(value)
+    os.replace(tmp_path, path)
+
+    if verbose >= 1:
+        print(f'written {len(items)} records to {path}')
+
+
+class SortedStringTable(Mapping):
+    """
+    Read-only mapping on top of a memory-mapped sorted string table.
+    Opening the table does not load the records: a lookup is a binary search over the memory-mapped file,
+    hence the pages are shared between processes through the page cache of the OS.
+    """
+
+    def __init__(self, path, decode_value=bytes.decode):
+        self.path = path
+        self.decode_value = decode_value
+        self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as infile:
+            self._mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._num_records = struct.unpack_from(HEADER_FORMAT, self._mm, 0)
+        assert magic == MAGIC, f'{self.path} is not a sorted string table'
+
+    def __getstate__(self):
+        return {'path': self.path, 'decode_value': self.decode_value}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def _record_at(self, index):
+        offset, = struct.unpack_from(OFFSET_FORMAT, self._mm, HEADER_SIZE + index * OFFSET_SIZE)
+        key_length, value_length = struct.unpack_from(RECORD_HEADER_FORMAT, self._mm, offset)
+        key_start = offset + RECORD_HEADER_SIZE
+        value_start = key_start + key_length
+        return self._mm[key_start:value_start], self._mm[value_start:value_start + value_length]
+
+    def _lower_bound(self, key):
+        """
+        :param bytes key: a key
+
+        :rtype: int
+        :return: index of the first record of which the key is not smaller than key
+        """
+        low, high = 0, self._num_records
+        while low < high:
+            middle = (low + high) // 2
+            middle_key, value = self._record_at(middle)
+            if middle_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _find(self, key):
+        """
+        :rtype: bytes or None
+        :return: the value of key or None if key is not in the table
+        """
+        if not isinstance(key, str):
+            return None
+        key = key.encode('utf-8')
+
+        index = self._lower_bound(key)
+        if index < self._num_records:
+            index_key, value = self._record_at(index)
+            if index_key == key:
+                return value
+        return None
+
+    def prefix_range(self, prefix):
+        """
+        :param str prefix: a prefix of keys, e.g., 'en\t'
+
+        :rtype: range
+        :return: indices of the records of which the key starts with prefix
+        """
+        prefix = prefix.encode('utf-8')
+        start = self._lower_bound(prefix)
+        end = start
+        if prefix:
+            # the smallest key that is larger than all keys with this prefix
+            end = self._lower_bound(prefix[:-1] + bytes([prefix[-1] + 1])) if prefix[-1] < 255 else self._num_records
+        return range(start, end)
+
+    def key_at(self, index):
+        """
+        :rtype: str
+        :return: the key of the record at index (in sorted order)
+        """
+        key, value = self._record_at(index)
+        return key.decode('utf-8')
+
+    def __getitem__(self, key):
+        value = self._find(key)
+        if value is None:
+            raise KeyError(key)
+        return self.decode_value(value)
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __len__(self):
+        return self._num_records
+
+    def __iter__(self):
+        for index in range(self._num_records):
+            yield self.key_at(index)
+
+    def close(self):
+        self._mm.close()
+
+
+def encode_path_info(path_info):
+    """(relative_path, line_number) -> b'relative_path\\tline_number'"""
+    relative_path, line_number = path_info
+    return f'{relative_path}\t{line_number}'.encode('utf-8')
+
+
+def decode_path_info(value):
+    """b'relative_path\\tline_number' -> (relative_path, line_number)"""
+    relative_path, line_number = value.decode('utf-8').rsplit('\t', 1)
+    return relative_path, int(line_number)
+
+
+def build_title_index(wiki_uri2path_info, path, verbose=0):
+    """
+    Convert the page2path.p index to a sorted string table.
+
+    :param dict wiki_uri2path_info: Wikipedia uri -> (relative_path, line_number)
+    :param str path: path of the sorted string table
+    """
+    items = ((wiki_uri.encode('utf-8'), encode_path_info(path_info))
+             for wiki_uri, path_info in wiki_uri2path_info.items())
+    write_sorted_string_table(path, items, verbose=verbose)
+
+
+def load_title_index(path):
+    """
+    Load the sorted string table created by build_title_index.
+
+    :rtype: SortedStringTable
+    :return: Wikipedia uri -> (relative_path, line_number)
+    """
+    return SortedStringTable(path, decode_value=decode_path_info)
+
+
+def get_sst_path(pickle_path):
+    """
+    Obtain the path of the sorted string table that replaces a pickled index,
+    e.g., resources/merged_indices.p -> resources/merged_indices.sst
+    """
+    return os.path.splitext(pickle_path)[0] + SST_EXTENSION
+
+
+def build_langlinks_index(wiki_langlinks, path, verbose=0):
+    """
+    Convert the langlinks index (merged_indices.p) to a sorted string table.
+
+    :param dict wiki_langlinks: language -> Wikipedia uri -> {language: Wikipedia uri}
+    :param str path: path of the sorted string table
+    """
+    items = ((f'{language}\t{wiki_uri}'.encode('utf-8'), json.dumps(lang2uri).encode('utf-8'))
+             for language, wiki_uri2langlinks in wiki_langlinks.items()
+             for wiki_uri, lang2uri in wiki_uri2langlinks.items())
+    write_sorted_string_table(path, items, verbose=verbose)
+
+
+class LanglinksIndex(Mapping):
+    """
+    Lazy replacement of the nested langlinks dict, supporting the same
+    wiki_langlinks[language][wiki_uri] -> {language: Wikipedia uri} access pattern.
+    The keys of the table are language<TAB>Wikipedia uri, hence the records of a language are adjacent.
+    """
+
+    def __init__(self, path):
+        self.table = SortedStringTable(path, decode_value=json.loads)
+
+        # skip from the first record of a language to the first record of the next language
+        self.languages = []
+        index = 0
+        while index < len(self.table):
+            language = self.table.key_at(index).split('\t', 1)[0]
+            self.languages.append(language)
+            index = self.table.prefix_range(f'{language}\t').stop
+
+    def __getitem__(self, language):
+        if language not in self.languages:
+            raise KeyError(language)
+        return LanguageLanglinks(self.table, language)
+
+    def __contains__(self, language):
+        return language in self.languages
+
+    def __len__(self):
+        return len(self.languages)
+
+    def __iter__(self):
+        return iter(self.languages)
+
+
+class LanguageLanglinks(Mapping):
+    """
+    The langlinks of one language of a LanglinksIndex.
+    """
+
+    def __init__(self, table, language):
+        self.table = table
+        self.language = language
+        self.prefix = f'{language}\t'
+
+    def __getitem__(self, wiki_uri):
+        return self.table[f'{self.prefix}{wiki_uri}']
+
+    def __contains__(self, wiki_uri):
+        return f'{self.prefix}{wiki_uri}' in self.table
+
+    def get(self, wiki_uri, default=None):
+        return self.table.get(f'{self.prefix}{wiki_uri}', default)
+
+    def __len__(self):
+        return len(self.table.prefix_range(self.prefix))
+
+    def __iter__(self):
+        for index in self.table.prefix_range(self.prefix):
+            yield self.table.key_at(index)[len(self.prefix):]
@@ -0,0 +1,156 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+for_encoding = 'é'
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+settings = {
+    'timeout': 30,
+    'max_retries': 5,
+    'backoff_factor': 1,
+    'backoff_max': 60,
+    'pool_maxsize': 10,
+    'max_concurrent_requests_per_host': 5
+}
+
+host2session = {}
+host2semaphore = {}
+sessions_lock = threading.Lock()
+
+
+def configure(**kwargs):
+    """
+    Update the settings of the HTTP client, e.g., with the "http" settings of config/mwep_settings.json
+
+    :param int timeout: timeout in seconds of one request
+    :param int max_retries: number of retries after a connection error, a timeout,
+    or a status code in RETRY_STATUS_CODES
+    :param float backoff_factor: the n-th retry waits backoff_factor * 2 ** (n - 1) seconds
+    :param float backoff_max: maximum number of seconds to wait before a retry
+    :param int pool_maxsize: maximum number of connections kept alive per host
+    :param int max_concurrent_requests_per_host: maximum number of requests that are sent
+    to one host at the same time (relevant when requests are sent from multiple threads)
+    """
+    settings.update(kwargs)
+
+    with sessions_lock:
+        for session in host2session.values():
+            session.close()
+        host2session.clear()
+        host2semaphore.clear()
+
+
+def get_session(url):
+    """
+    Obtain the session of the host of a url.
+    Every host has its own session with a pool of keep-alive connections.
+
+    :rtype: requests.Session
+    """
+    host = urlparse(url).netloc
+
+    with sessions_lock:
+        if host not in host2session:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=settings['pool_maxsize'])
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            host2session[host] = session
+
+        return host2session[host]
+
+
+def get_host_semaphore(url):
+    """
+    Obtain the semaphore that bounds the number of concurrent requests to the host of a url.
+
+    :rtype: threading.BoundedSemaphore
+    """
+    host = urlparse(url).netloc
+
+    with sessions_lock:
+        if host not in host2semaphore:
+            host2semaphore[host] = threading.BoundedSemaphore(settings['max_concurrent_requests_per_host'])
+
+        return host2semaphore[host]
+
+
+def get_backoff_time(attempt, response=None):
+    """
+    Exponential backoff, bounded by the backoff_max setting.
+    The Retry-After header of the response is respected if it is provided.
+
+    :param int attempt: 0 for the first attempt
+    """
+    backoff_time = settings['backoff_factor'] * 2 ** attempt
+
+    if response is not None:
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            backoff_time = int(retry_after)
+
+    return min(backoff_time, settings['backoff_max'])
+
+
+def request(method, url, params=None, timeout=None, **kwargs):
+    """
+    Perform a request using the session of the host of the url.
+    At most max_concurrent_requests_per_host requests are sent to one host at the same time.
+    If stream=True, the semaphore is released when the headers are received, i.e., before the body is read,
+    and the caller should close the response (e.g., with a with statement).
+    Connection errors, timeouts, and responses with a status code in RETRY_STATUS_CODES are retried
+    with exponential backoff.
+
+    :param str method: e.g., 'GET' or 'POST'
+    :param str url: a url
+    :param dict params: query parameters
+    :param int timeout: if None, the timeout setting is used
+
+    :rtype: requests.Response
+    :return: the response of the last attempt
+
+    :raises requests.ConnectionError, requests.Timeout: if the last attempt failed
+    """
+    session = get_session(url)
+    semaphore = get_host_semaphore(url)
+    if timeout is None:
+        timeout = settings['timeout']
+
+    max_retries = settings['max_retries']
+    for attempt in range(max_retries + 1):
+        response = None
+        try:
+            with semaphore:
+                response = session.request(method, url, params=params, timeout=timeout, **kwargs)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                return response
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+
+        time.sleep(get_backoff_time(attempt, response))
+
+
+def get(url, params=None, timeout=None, **kwargs):
+    """
+    Perform a GET request (see function "request").
+
+    :rtype: requests.Response
+    """
+    return request('GET', url, params=params, timeout=timeout, **kwargs)
+
+
+def post(url, data=None, params=None, timeout=None, **kwargs):
+    """
+    Perform a POST request (see function "request"), e.g., for a query that is too long for a url.
+
+    :param dict data: form data
+
+    :rtype: requests.Response
+    """
+    return request('POST', url, params=params, timeout=timeout, data=data, **kwargs)
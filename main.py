@@ -8,7 +8,10 @@ Usage:
    --path_mapping_wd_to_sem=<path_mapping_wd_to_sem>\
    --languages=<languages>\
    --wikipedia_sources=<wikipedia_sources>\
-   --verbose=<verbose>
+   --verbose=<verbose>\
+   [--refresh]\
+   [--resume]\
+   [--incremental]
 
 Options:
     --config_path=<config_path>
@@ -18,6 +21,9 @@ Options:
     --languages=<languages> languages separated by -, e.g., "nl-it-en"
     --wikipedia_sources=<wikipedia_sources> if "True", crawl Wikipedia sources
     --verbose=<verbose> 0 --> no stdout 1 --> general stdout 2 --> detailed stdout
+    --refresh  ignore the cached SPARQL responses and query Wikidata again
+    --resume  keep the output of a previous run and skip the stages and NAF files that it has completed
+    --incremental  keep the output of the previous run and only process the incidents that are new or changed
 
 Example:
     python main.py --config_path="config/mwep_settings.json"\
@@ -28,33 +34,46 @@ Example:
     --wikipedia_sources="False"\
     --verbose=1
 """
+import copy
 import json
 import os
 import pickle
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import pandas as pd
-import spacy
 from tqdm import tqdm
+import urllib3
 
 import classes
+import cache_utils
 import crawl_utils
+import disk_index_utils
+import http_utils
 import json_utils
 import xml_utils
 import native_api_utils
 import pilot_utils
+import pipeline_utils
 import utils
 import wikipedia_utils as wu
 
 for_encoding = 'é'
 
 def add_wikipedia_pages_from_api(incidents, wdt_ids):
+    """
+    Add the Wikipedia pages (sitelinks) of the incidents according to the Wikidata API,
+    and add the sitelinks to the signatures of the incidents (see utils.add_sitelinks_to_signature).
+    """
     assert (len(wdt_ids) > 0)
     id_batches = utils.split_in_batches(wdt_ids, 50)
 
+    wdt_id2sitelinks = {}
     for index, batch in enumerate(id_batches):
         wiki_pages = native_api_utils.obtain_wiki_page_titles(batch, languages)
+        wdt_id2sitelinks.update(wiki_pages)
         for incident in incidents:
             if incident.wdt_id in wiki_pages.keys():
                 incident_wikipedia = wiki_pages[incident.wdt_id]
@@ -71,15 +90,26 @@ def add_wikipedia_pages_from_api(incidents, wdt_ids):
                             found_by=['API']
                         )
                         incident.reference_texts.append(ref_text)
+
+    for incident in incidents:
+        incident.signature = utils.add_sitelinks_to_signature(incident.signature,
+                                                              wdt_id2sitelinks.get(incident.wdt_id, {}))
     return incidents
 
 
 def retrieve_incidents_per_type(type_qid,
                                 event_type_matching,
                                 json_wd_to_sem,
-                                limit=10):
+                                limit=10,
+                                sparql_settings={},
+                                add_api_titles=True):
     """
     Given an event type identifier, retrieve incidents that belong to this type.
+
+    :param dict sparql_settings: keyword arguments for utils.construct_and_run_query,
+    e.g., the "sparql" settings of config/mwep_settings.json
+    :param bool add_api_titles: if False, the Wikipedia titles of the API are not added
+    (see function "add_wikipedia_pages_from_api")
     """
     with open(json_wd_to_sem, 'rb') as f:
         wdt_fn_mappings_COL = json.load(f)
@@ -90,7 +120,8 @@ def retrieve_incidents_per_type(type_qid,
                                                   event_type_matching,
                                                   languages,
                                                   wdt_fn_mappings_COL,
-                                                  limit)
+                                                  limit,
+                                                  **sparql_settings)
     wdt_ids = []
     if not len(results_by_id.items()):
         return [], ''
@@ -115,34 +146,37 @@ def retrieve_incidents_per_type(type_qid,
             wdt_id=wdt_id,
             direct_types=direct_types,
             extra_info=extra_info,
-            reference_texts=ref_texts
+            reference_texts=ref_texts,
+            signature=utils.get_incident_signature(inc_data)
         )
         incidents.append(incident)
 
     print("Wikidata querying and storing finished. Number of incidents:", len(incidents))
+    if not add_api_titles:
+        return incidents
     print('\n### 2. ### Enriching the reference texts through the Wikipedia-Wikidata API...')
     incidents = add_wikipedia_pages_from_api(incidents, wdt_ids)
     print('API querying done. Number of incidents:', len(incidents))
     return incidents
 
 
-def obtain_reference_texts(incidents, wiki_folder, wiki_uri2path_info, language2info):
+def obtain_reference_texts(incidents, wiki_folder, wiki_uri2path_info, language2info, num_workers=1):
     print(
         '\n### 3. ### Retrieve reference text information: text and entity annotations from the local version of Wikipedia.')
+    page_requests = [(ref_text.name, language2info[ref_text.language]['prefix'], ref_text.language)
+                     for incident in incidents
+                     for ref_text in incident.reference_texts]
+
+    page_results = iter(wu.load_wiki_pages_info(page_requests,
+                                                wiki_folder,
+                                                wiki_uri2path_info,
+                                                num_workers=num_workers))
+
     new_incidents = []
     for incident in tqdm(incidents):
         new_reference_texts = []
         for ref_text in incident.reference_texts:
-            language = ref_text.language
-            wiki_title = ref_text.name
-
-            prefix = language2info[ref_text.language]['prefix']
-
-            text, annotations, success, reason = wu.load_wiki_page_info(wiki_title,
-                                                                        prefix,
-                                                                        language,
-                                                                        wiki_folder,
-                                                                        wiki_uri2path_info)
+            text, annotations, success, reason = next(page_results)
 
             if success:
                 ref_text.annotations = annotations
@@ -158,15 +192,576 @@ def obtain_reference_texts(incidents, wiki_folder, wiki_uri2path_info, language2
     return new_incidents
 
 
-def get_primary_rt_links(incidents):
-    for incident in tqdm(incidents):
+def get_primary_rt_links(incidents, num_workers=1):
+    """
+    Add the external links of the Wikipedia pages as primary reference texts.
+    The titles are queried in batches of 50 per language. The batches are processed by num_workers threads,
+    while http_utils bounds the number of concurrent requests per Wikipedia host.
+    """
+    language2titles = defaultdict(set)
+    for incident in incidents:
+        for ref_text in incident.reference_texts:
+            language2titles[ref_text.language].add(ref_text.name)
+
+    batches = [(language, batch)
+               for language, titles in language2titles.items()
+               for batch in utils.split_in_batches(sorted(titles), 50)]
+
+    language_title2links = {}
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        all_title2links = executor.map(lambda batch: native_api_utils.obtain_primary_rt_links_batch(batch[1],
+                                                                                                    batch[0]),
+                                       batches)
+
+        for (language, batch), title2links in tqdm(zip(batches, all_title2links), total=len(batches)):
+            for title, ext_links in title2links.items():
+                language_title2links[(language, title)] = ext_links
+
+    for incident in incidents:
         for ref_text in incident.reference_texts:
-            ext_links = native_api_utils.obtain_primary_rt_links(ref_text.name, ref_text.language)
+            ext_links = language_title2links[(ref_text.language, ref_text.name)]
             if ext_links:
                 ref_text.primary_ref_texts = ext_links
     return incidents
 
 
+def create_naf_jobs(incidents, url2ref_text=None):
+    """
+    Collect the texts of the reference texts of the incidents to process with spaCy
+    (see function "pilot_utils.texts_to_naf"). If Wikipedia sources are crawled,
+    the primary reference texts are first added to the incidents: the urls of all incidents are crawled once,
+    and the resulting ReferenceText is added to every incident that cites the url.
+    A ReferenceText that is shared by incidents results in one NAF job.
+
+    :param dict url2ref_text: url -> ReferenceText (None if the crawl failed) of the urls that have been crawled
+    for other incidents of the same event type, e.g., the previous chunks in streaming mode.
+    These urls are not crawled again, and their texts are not added to the NAF jobs again.
+    It is updated with the urls that are crawled.
+
+    :rtype: list
+    :return: list of dicts with the keys wiki_title, text, wiki_uri, annotations, prefix, language, and dct
+    """
+    if url2ref_text is None:
+        url2ref_text = {}
+
+    # ids of the reference texts that have a NAF job
+    processed_ref_text_ids = {id(ref_text_obj)
+                              for ref_text_obj in url2ref_text.values()
+                              if ref_text_obj is not None}
+
+    # add primary text urls
+    if crawl_wikipedia_sources:
+        incident2primary_text_urls = {incident_obj: {primary_text_url
+                                                     for ref_text_obj in incident_obj.reference_texts
+                                                     for primary_text_url in ref_text_obj.primary_ref_texts}
+                                      for incident_obj in incidents}
+
+        urls_to_crawl = {primary_text_url
+                         for primary_text_urls in incident2primary_text_urls.values()
+                         for primary_text_url in primary_text_urls
+                         if primary_text_url not in url2ref_text}
+        primary_url_to_ref_text_obj = crawl_utils.get_ref_text_obj_of_primary_reference_texts(sorted(urls_to_crawl),
+                                                                                              timeout,
+                                                                                              startswith=startswith,
+                                                                                              accepted_languages=accepted_languages,
+                                                                                              excluded_domains=excluded_domains,
+                                                                                              title_required=True,
+                                                                                              num_chars_range=num_chars_range,
+                                                                                              illegal_substrings=illegal_substrings,
+                                                                                              illegal_chars_in_title=illegal_chars_in_title,
+                                                                                              num_workers=crawl_workers,
+                                                                                              verbose=verbose)
+        for url in urls_to_crawl:
+            url2ref_text[url] = primary_url_to_ref_text_obj.get(url)
+
+        for incident_obj, primary_text_urls in incident2primary_text_urls.items():
+            for url in sorted(primary_text_urls):
+                if url2ref_text[url] is not None:
+                    incident_obj.reference_texts.append(url2ref_text[url])
+
+    naf_jobs = []
+    for incident_obj in incidents:
+
+        # collect texts to process with spaCy
+        for ref_text_obj in incident_obj.reference_texts:
+            if id(ref_text_obj) in processed_ref_text_ids:
+                continue
+            processed_ref_text_ids.add(id(ref_text_obj))
+
+            language = ref_text_obj.language
+
+            # dct of document
+            if ref_text_obj.found_by == ['Wikipedia source']:
+                if ref_text_obj.creation_date is not None:
+                    dct = ref_text_obj.creation_date
+                else:
+                    dct = datetime(1,1,1)
+            else: # wikipedia page
+                year, month, day = language2info[language]['year_month_day']
+                dct = datetime(year, month, day)
+
+            print(ref_text_obj.name, ref_text_obj.uri, ref_text_obj.found_by, dct)
+
+            naf_jobs.append({'wiki_title': ref_text_obj.name,
+                             'text': ref_text_obj.content,
+                             'wiki_uri': ref_text_obj.uri,
+                             'annotations': ref_text_obj.annotations,
+                             'prefix': language2info[language]['prefix'],
+                             'language': language,
+                             'dct': dct})
+    return naf_jobs
+
+
+def load_previous_incidents(path):
+    """
+    :param str path: path of a pickled IncidentCollection of a previous run (see utils.make_output_filename)
+
+    :rtype: list
+    :return: the incidents of the collection or an empty list if the file does not exist
+    """
+    if not os.path.exists(path):
+        return []
+    return utils.load_pickle(path).incidents
+
+
+def split_changed_incidents(incidents, previous_incidents):
+    """
+    Compare the incidents with the incidents of a previous run by their signature (see utils.get_incident_signature).
+
+    :rtype: tuple
+    :return: (incidents that are new or changed, incidents of the previous run that did not change)
+    """
+    wdt_id2previous_incident = {incident.wdt_id: incident for incident in previous_incidents}
+
+    changed_incidents = []
+    unchanged_incidents = []
+    for incident in incidents:
+        previous_incident = wdt_id2previous_incident.get(incident.wdt_id)
+        # collections of older runs do not have signatures
+        if previous_incident is not None and getattr(previous_incident, 'signature', '') == incident.signature:
+            unchanged_incidents.append(previous_incident)
+        else:
+            changed_incidents.append(incident)
+
+    return changed_incidents, unchanged_incidents
+
+
+def remove_stale_naf_files(previous_incidents, incidents, owner):
+    """
+    Remove the NAF files of the incidents of a previous run that do not belong to the incidents anymore,
+    e.g., because an incident was removed from Wikidata or a Wikipedia page was renamed.
+    NAF files that are written by another event type in this run are kept (see xml_utils.remove_unclaimed_naf_file).
+
+    :rtype: int
+    :return: number of NAF files that were removed
+    """
+    naf_paths = {pilot_utils.get_naf_path(naf_output_folder, ref_text_obj.language, ref_text_obj.name)
+                 for incident_obj in incidents
+                 for ref_text_obj in incident_obj.reference_texts}
+
+    num_removed = 0
+    for incident_obj in previous_incidents:
+        for ref_text_obj in incident_obj.reference_texts:
+            naf_path = pilot_utils.get_naf_path(naf_output_folder, ref_text_obj.language, ref_text_obj.name)
+            if naf_path not in naf_paths and xml_utils.remove_unclaimed_naf_file(naf_path, owner):
+                num_removed += 1
+
+    return num_removed
+
+
+CHECKPOINT_STAGES = ['incidents', 'pilots', 'primary_rt_links', 'naf_jobs', 'sparql_incidents']
+
+
+def run_stage(incident_type_uri, stage, function, *args, **kwargs):
+    """
+    Run a stage of an event type and store its result as a checkpoint (see utils.make_checkpoint_filename).
+    If --resume is given and the checkpoint exists, the stored result is returned instead.
+
+    :param str stage: name of the stage, one of CHECKPOINT_STAGES
+    :param function: function that runs the stage, it is called with args and kwargs
+    """
+    checkpoint_file = utils.make_checkpoint_filename(bin_folder, incident_type_uri, languages, stage)
+    if resume and os.path.exists(checkpoint_file):
+        print(f'resuming from checkpoint {checkpoint_file}')
+        return utils.load_pickle(checkpoint_file)
+
+    result = function(*args, **kwargs)
+    utils.dump_pickle(result, checkpoint_file)
+    return result
+
+
+def process_or_resume_event_type(incident_type_uri):
+    """
+    Process an event type (see functions "process_event_type" and "process_event_type_streaming"),
+    unless --resume is given and a previous run has completed the event type.
+    When an event type is completed, the checkpoints of its stages are replaced by the stats row.
+
+    :rtype: tuple
+    :return: (stats row of the event type, pilot collection) or (None, None) if no incidents are found
+    """
+    stats_file = utils.make_checkpoint_filename(bin_folder, incident_type_uri, languages, 'stats')
+    pilot_file = utils.make_output_filename(bin_folder, incident_type_uri, languages + ['pilot'])
+    if resume and os.path.exists(stats_file) and os.path.exists(pilot_file):
+        print(f'{incident_type_uri} has been completed by a previous run')
+        return utils.load_pickle(stats_file), utils.load_pickle(pilot_file)
+
+    if pipeline_settings['streaming'] and not incremental:
+        inc_stats, pilot_collection = process_event_type_streaming(incident_type_uri)
+    else:
+        inc_stats, pilot_collection = process_event_type(incident_type_uri)
+
+    if inc_stats is not None:
+        utils.dump_pickle(inc_stats, stats_file)
+        utils.remove_checkpoints(bin_folder, incident_type_uri, languages, CHECKPOINT_STAGES)
+
+    return inc_stats, pilot_collection
+
+
+def process_event_type(incident_type_uri):
+    """
+    Run all steps for one event type: retrieve the incidents, select the pilot incidents, and store them to
+    BIN, RDF, and NAF. The settings and the shared resources (e.g., the Wikipedia indices and the spaCy models)
+    are the module-level variables that are set when main.py is run.
+
+    If --incremental is given, the incidents that did not change since the previous run are taken from the BIN files
+    of the previous run, and only the new or changed incidents are retrieved from Wikipedia and processed with spaCy.
+
+    :rtype: tuple
+    :return: (stats row of the event type, pilot collection) or (None, None) if no incidents are found
+    """
+    incident_type = incident_type_uri
+
+    pilot_and_languages = languages + ['pilot']
+
+    inc_stats = [incident_type_uri, ','.join(languages)]
+
+    print('\n\n\n')
+    print('----- INCIDENT TYPE: %s -----' % incident_type_uri)
+    print('\n\n')
+
+    start = time.time()
+
+    output_file = utils.make_output_filename(bin_folder,
+                                             incident_type_uri,
+                                             languages)
+
+    if resume and os.path.exists(output_file):
+        print(f'resuming from {output_file}')
+        collection = utils.load_pickle(output_file)
+    else:
+        # Query SPARQL and the API to get incidents, their properties, and labels.
+        incidents = run_stage(incident_type_uri,
+                              'incidents',
+                              retrieve_incidents_per_type,
+                              incident_type_uri,
+                              event_type_matching,
+                              json_wd_to_sem,
+                              99999,
+                              sparql_settings=mwep_settings['sparql'])
+
+        if not len(incidents):
+            print('NO INCIDENTS FOUND FOR %s. Continuing to next type...')
+            return None, None
+
+        # the signatures include the sitelinks of the API, hence a new or renamed Wikipedia page is detected
+        unchanged_incidents = []
+        if incremental:
+            incidents, unchanged_incidents = split_changed_incidents(incidents, load_previous_incidents(output_file))
+            print(f'{len(unchanged_incidents)} incidents did not change since the previous run')
+
+        new_incidents = obtain_reference_texts(incidents,
+                                               wiki_folder,
+                                               wiki_uri2path_info,
+                                               language2info,
+                                               num_workers=wiki_retrieval_workers)
+
+        collection = classes.IncidentCollection(incidents=new_incidents + unchanged_incidents,
+                                                incident_type=incident_type,
+                                                incident_type_uri=incident_type_uri,
+                                                languages=languages)
+
+        utils.dump_pickle(collection, output_file)
+
+    inc_stats.append(len(collection.incidents))
+
+    ttl_filename = '%s/%s_%s.ttl' % (rdf_folder, incident_type_uri, '_'.join(languages))
+    collection.serialize(ttl_filename)
+
+    after_extraction = time.time()
+
+    pilot_and_languages_file = utils.make_output_filename(bin_folder, incident_type_uri, pilot_and_languages)
+
+    # the pilot selection changes the incidents of the collection, hence these are part of the next checkpoints.
+    # In incremental mode, the pilots of the previous run that did not change are kept as they are,
+    # and the pilots are only selected from the other incidents (the processed collection).
+    def select_pilots():
+        unchanged_pilots = []
+        processed_collection = collection
+        if incremental:
+            changed_incidents, unchanged_pilots = split_changed_incidents(collection.incidents,
+                                                                          load_previous_incidents(pilot_and_languages_file))
+            print(f'{len(unchanged_pilots)} pilot incidents did not change since the previous run')
+            processed_collection = classes.IncidentCollection(incidents=changed_incidents,
+                                                              incident_type=incident_type,
+                                                              incident_type_uri=incident_type_uri,
+                                                              languages=languages)
+
+        pilots = pilot_utils.create_pilot_data(processed_collection,
+                                               languages,
+                                               mwep_settings['processing']["must_have_all_languages"],
+                                               mwep_settings['processing']["must_have_english"],
+                                               mwep_settings['processing']["one_page_per_language"])
+
+        max_new_pilots = max(max_pilot_incidents - len(unchanged_pilots), 0)
+        if len(pilots) > max_new_pilots:
+            pilots = list(pilots)[:max_new_pilots]
+            print(f'selected first {len(pilots)} pilot incidents')
+        return collection.incidents, processed_collection.incidents, unchanged_pilots, pilots
+
+    collection.incidents, processed_incidents, unchanged_pilots, pilots = run_stage(incident_type_uri,
+                                                                                    'pilots',
+                                                                                    select_pilots)
+
+    after_pilot_selection = time.time()
+
+    def add_primary_rt_links():
+        new_pilots = get_primary_rt_links(pilots, num_workers=mwep_settings['primary_rt_links_workers'])
+        return collection.incidents, processed_incidents, unchanged_pilots, new_pilots
+
+    collection.incidents, processed_incidents, unchanged_pilots, pilots = run_stage(incident_type_uri,
+                                                                                    'primary_rt_links',
+                                                                                    add_primary_rt_links)
+
+    after_primary_texts = time.time()
+
+    pilot_collection = classes.IncidentCollection(incidents=unchanged_pilots + list(pilots),
+                                                  incident_type_uri=incident_type_uri,
+                                                  incident_type=incident_type,
+                                                  languages=languages)
+
+    ttl_filename = '%s/%s_%s_pilot.ttl' % (rdf_folder, incident_type_uri, '_'.join(pilot_and_languages))
+    pilot_collection.serialize(ttl_filename)
+
+    if len(pilot_collection.incidents) == 0:
+        print('No pilot incidents for type %s' % incident_type_uri)
+    else:
+        print('start pilot data processing', datetime.now())
+
+    # only the new pilots are crawled and processed with spaCy, the NAF files of the unchanged pilots are reused
+    def collect_texts():
+        return collection.incidents, processed_incidents, pilot_collection.incidents, create_naf_jobs(pilots)
+
+    collection.incidents, processed_incidents, pilot_collection.incidents, naf_jobs = run_stage(incident_type_uri,
+                                                                                                'naf_jobs',
+                                                                                                collect_texts)
+
+    # process with spaCy in batches and store to NAF
+    pilot_utils.texts_to_naf(naf_jobs,
+                             languages,
+                             models,
+                             batch_size=spacy_batch_size,
+                             n_process=spacy_n_process,
+                             output_folder=naf_output_folder,
+                             wiki_langlinks=wiki_langlinks,
+                             skip_existing=resume,
+                             owner=incident_type_uri)
+
+    if incremental:
+        num_removed = remove_stale_naf_files(load_previous_incidents(pilot_and_languages_file),
+                                             pilot_collection.incidents,
+                                             incident_type_uri)
+        print(f'removed {num_removed} NAF files of the previous run that are not part of the pilot incidents anymore')
+
+    utils.dump_pickle(pilot_collection, pilot_and_languages_file)
+
+    # add Wikidata information to NAF (entities and coreferences layer) of the processed incidents
+    processed_collection = classes.IncidentCollection(incidents=processed_incidents,
+                                                      incident_type=incident_type,
+                                                      incident_type_uri=incident_type_uri,
+                                                      languages=languages)
+    xml_utils.add_wikidata_uris_to_naf_files(inc_coll_obj=processed_collection,
+                                             main_naf_folder=mwep_settings['naf_output_folder'],
+                                             languages=accepted_languages,
+                                             owner=incident_type_uri,
+                                             verbose=2)
+
+    inc_stats.append(len(pilot_collection.incidents))
+
+    end = time.time()
+
+    inc_stats.append(utils.format_time(after_extraction - start))
+    inc_stats.append(utils.format_time(after_pilot_selection - after_extraction))
+    inc_stats.append(utils.format_time(after_primary_texts - after_pilot_selection))
+    inc_stats.append(utils.format_time(end - after_primary_texts))
+    inc_stats.append(utils.format_time(end - start))
+
+    return inc_stats, pilot_collection
+
+
+def copy_incidents(incidents):
+    """
+    Copy the incidents, such that the pilot selection (which shortens the texts and adds labels) does not change
+    the incidents of the collection. The texts themselves are not copied.
+    """
+    new_incidents = []
+    for incident in incidents:
+        new_incident = copy.copy(incident)
+        new_incident.extra_info = copy.copy(incident.extra_info)
+        new_incident.reference_texts = [copy.copy(ref_text) for ref_text in incident.reference_texts]
+        new_incidents.append(new_incident)
+    return new_incidents
+
+
+def process_event_type_streaming(incident_type_uri):
+    """
+    Streaming version of process_event_type: after the SPARQL query, the incidents are processed in chunks
+    of chunk_size incidents that flow through the steps, each step running in its own thread
+    (see function "pipeline_utils.run_pipeline"). Hence, the network-bound steps (API, primary reference texts)
+    overlap with the CPU-bound steps (spaCy, NAF), and the first NAF files are written
+    before all incidents have been retrieved.
+
+    The times in the stats row are the number of seconds that the steps were busy;
+    since the steps overlap, they add up to more than the total time.
+
+    :rtype: tuple
+    :return: (stats row of the event type, pilot collection) or (None, None) if no incidents are found
+    """
+    incident_type = incident_type_uri
+
+    pilot_and_languages = languages + ['pilot']
+
+    inc_stats = [incident_type_uri, ','.join(languages)]
+
+    print('\n\n\n')
+    print('----- INCIDENT TYPE: %s (streaming) -----' % incident_type_uri)
+    print('\n\n')
+
+    start = time.time()
+
+    incidents = run_stage(incident_type_uri,
+                          'sparql_incidents',
+                          retrieve_incidents_per_type,
+                          incident_type_uri,
+                          event_type_matching,
+                          json_wd_to_sem,
+                          99999,
+                          sparql_settings=mwep_settings['sparql'],
+                          add_api_titles=False)
+
+    if not len(incidents):
+        print('NO INCIDENTS FOUND FOR %s. Continuing to next type...')
+        return None, None
+
+    stage2time = {'sparql': time.time() - start}
+    num_pilots = 0
+    url2ref_text = {} # every url is crawled once for all chunks (see function "create_naf_jobs")
+
+    def add_api_titles(chunk):
+        return add_wikipedia_pages_from_api(chunk, [incident.wdt_id for incident in chunk])
+
+    def add_texts(chunk):
+        return obtain_reference_texts(chunk,
+                                      wiki_folder,
+                                      wiki_uri2path_info,
+                                      language2info,
+                                      num_workers=wiki_retrieval_workers)
+
+    def select_pilots(chunk):
+        nonlocal num_pilots
+        chunk_collection = classes.IncidentCollection(incidents=copy_incidents(chunk),
+                                                      incident_type=incident_type,
+                                                      incident_type_uri=incident_type_uri,
+                                                      languages=languages)
+        pilots = pilot_utils.create_pilot_data(chunk_collection,
+                                               languages,
+                                               mwep_settings['processing']["must_have_all_languages"],
+                                               mwep_settings['processing']["must_have_english"],
+                                               mwep_settings['processing']["one_page_per_language"])
+        pilots = list(pilots)[:max(max_pilot_incidents - num_pilots, 0)]
+        num_pilots += len(pilots)
+        return chunk, pilots
+
+    def add_primary_texts(chunk_and_pilots):
+        chunk, pilots = chunk_and_pilots
+        pilots = get_primary_rt_links(pilots, num_workers=mwep_settings['primary_rt_links_workers'])
+        return chunk, pilots, create_naf_jobs(pilots, url2ref_text)
+
+    def store_to_naf(chunk_pilots_and_naf_jobs):
+        chunk, pilots, naf_jobs = chunk_pilots_and_naf_jobs
+        pilot_utils.texts_to_naf(naf_jobs,
+                                 languages,
+                                 models,
+                                 batch_size=spacy_batch_size,
+                                 n_process=spacy_n_process,
+                                 output_folder=naf_output_folder,
+                                 wiki_langlinks=wiki_langlinks,
+                                 skip_existing=resume,
+                                 owner=incident_type_uri)
+
+        # add Wikidata information to NAF (entities and coreferences layer)
+        if pilots:
+            pilot_chunk_collection = classes.IncidentCollection(incidents=pilots,
+                                                                incident_type=incident_type,
+                                                                incident_type_uri=incident_type_uri,
+                                                                languages=languages)
+            xml_utils.add_wikidata_uris_to_naf_files(inc_coll_obj=pilot_chunk_collection,
+                                                     main_naf_folder=mwep_settings['naf_output_folder'],
+                                                     languages=accepted_languages,
+                                                     owner=incident_type_uri,
+                                                     verbose=2)
+        return chunk, pilots
+
+    outputs = pipeline_utils.run_pipeline(utils.split_in_batches(incidents, pipeline_settings['chunk_size']),
+                                          [('api', add_api_titles),
+                                           ('wikipedia', add_texts),
+                                           ('pilot selection', select_pilots),
+                                           ('primary texts', add_primary_texts),
+                                           ('naf', store_to_naf)],
+                                          queue_size=pipeline_settings['queue_size'],
+                                          stage2time=stage2time)
+
+    new_incidents = [incident for chunk, pilots in outputs for incident in chunk]
+    pilots = [incident for chunk, pilots in outputs for incident in pilots]
+
+    collection = classes.IncidentCollection(incidents=new_incidents,
+                                            incident_type=incident_type,
+                                            incident_type_uri=incident_type_uri,
+                                            languages=languages)
+
+    output_file = utils.make_output_filename(bin_folder,
+                                             incident_type_uri,
+                                             languages)
+
+    utils.dump_pickle(collection, output_file)
+
+    ttl_filename = '%s/%s_%s.ttl' % (rdf_folder, incident_type_uri, '_'.join(languages))
+    collection.serialize(ttl_filename)
+
+    pilot_collection = classes.IncidentCollection(incidents=pilots,
+                                                  incident_type_uri=incident_type_uri,
+                                                  incident_type=incident_type,
+                                                  languages=languages)
+
+    ttl_filename = '%s/%s_%s_pilot.ttl' % (rdf_folder, incident_type_uri, '_'.join(pilot_and_languages))
+    pilot_collection.serialize(ttl_filename)
+
+    out_file = utils.make_output_filename(bin_folder, incident_type_uri, pilot_and_languages)
+
+    utils.dump_pickle(pilot_collection, out_file)
+
+    end = time.time()
+
+    inc_stats.append(len(collection.incidents))
+    inc_stats.append(len(pilot_collection.incidents))
+    inc_stats.append(utils.format_time(stage2time['sparql'] + stage2time.get('api', 0) + stage2time.get('wikipedia', 0)))
+    inc_stats.append(utils.format_time(stage2time.get('pilot selection', 0)))
+    inc_stats.append(utils.format_time(stage2time.get('primary texts', 0)))
+    inc_stats.append(utils.format_time(stage2time.get('naf', 0)))
+    inc_stats.append(utils.format_time(end - start))
+
+    return inc_stats, pilot_collection
+
+
 if __name__ == '__main__':
     from docopt import docopt
 
@@ -180,8 +775,9 @@ if __name__ == '__main__':
     print()
 
     mwep_settings = json.load(open(arguments['--config_path']))
-    event_types = {line.strip()
-                   for line in open(arguments['--path_event_types'])}
+    # unique event types in the order of the file
+    event_types = list(dict.fromkeys(line.strip()
+                                     for line in open(arguments['--path_event_types'])))
     crawl_wikipedia_sources = arguments['--wikipedia_sources'] == "True"
     max_pilot_incidents = mwep_settings['max_pilot_incidents']
     verbose = int(arguments['--verbose'])
@@ -197,29 +793,58 @@ if __name__ == '__main__':
     timeout = mwep_settings['newsplease']['timeout']
     illegal_substrings = mwep_settings['newsplease']['illegal_substrings']
     illegal_chars_in_title = mwep_settings['newsplease']['illegal_chars_in_title']
+    crawl_workers = mwep_settings['newsplease']['num_workers']
+    crawl_utils.wayback_rate_limiter = crawl_utils.RateLimiter(mwep_settings['newsplease']['wayback_requests_per_second'])
+    crawl_utils.wayback_pool = urllib3.PoolManager(maxsize=crawl_workers)
 
     wiki_folder = mwep_settings['wiki_folder']
+    wiki_retrieval_workers = mwep_settings['wiki_retrieval_workers']
     naf_output_folder = mwep_settings['naf_output_folder']
     rdf_folder = mwep_settings['rdf_folder']
     bin_folder = mwep_settings['bin_folder']
     json_folder = mwep_settings['json_folder']
 
+    http_utils.configure(**mwep_settings['http'])
+    utils.label_cache = cache_utils.LabelCache(**mwep_settings['label_cache'])
+    if mwep_settings['sparql_cache']['enabled']:
+        utils.response_cache = cache_utils.ResponseCache(mwep_settings['sparql_cache']['folder'],
+                                                         max_age_hours=mwep_settings['sparql_cache']['max_age_hours'],
+                                                         refresh=arguments['--refresh'])
+    if mwep_settings['crawl_store']['enabled']:
+        crawl_utils.crawl_store = cache_utils.CrawlStore(mwep_settings['crawl_store']['path'],
+                                                         revalidate_after_days=mwep_settings['crawl_store']['revalidate_after_days'])
+
     event_type_matching = mwep_settings['event_type_matching']
     json_wd_to_sem = arguments['--path_mapping_wd_to_sem']
 
     project = arguments['--project']
 
-    utils.remove_and_create_folder(rdf_folder)
-    utils.remove_and_create_folder(naf_output_folder)
-    utils.remove_and_create_folder(bin_folder)
-    utils.remove_and_create_folder(json_folder)
+    resume = arguments['--resume']
+    incremental = arguments['--incremental']
+    if incremental and mwep_settings['pipeline']['streaming']:
+        print('the streaming mode is not used in incremental mode')
 
-    print('NAF, RDF, JSON, and BIN directories have been re-created')
+    if resume or incremental:
+        for folder in [rdf_folder, naf_output_folder, bin_folder, json_folder]:
+            os.makedirs(folder, exist_ok=True)
+
+        print('NAF, RDF, JSON, and BIN directories of the previous run are kept')
+    else:
+        utils.remove_and_create_folder(rdf_folder)
+        utils.remove_and_create_folder(naf_output_folder)
+        utils.remove_and_create_folder(bin_folder)
+        utils.remove_and_create_folder(json_folder)
+
+        print('NAF, RDF, JSON, and BIN directories have been re-created')
 
     # load index and language info
-    path_uri2path_info = os.path.join(wiki_folder, 'page2path.p')
-    with open(path_uri2path_info, 'rb') as infile:
-        wiki_uri2path_info = pickle.load(infile)  # make take some time
+    path_title_index = os.path.join(wiki_folder, disk_index_utils.TITLE_INDEX_BASENAME)
+    if os.path.exists(path_title_index):
+        wiki_uri2path_info = disk_index_utils.load_title_index(path_title_index)
+    else:
+        path_uri2path_info = os.path.join(wiki_folder, 'page2path.p')
+        with open(path_uri2path_info, 'rb') as infile:
+            wiki_uri2path_info = pickle.load(infile)  # make take some time
 
     language_info_path = os.path.join(wiki_folder, 'language2info.json')
     with open(language_info_path, 'r')  as infile:
@@ -228,19 +853,26 @@ if __name__ == '__main__':
     print("Wikipedia indices loaded")
 
     wiki_langlinks_path = mwep_settings['wiki_langlinks_path']
-    with open(wiki_langlinks_path, 'rb') as infile:
-        wiki_langlinks = pickle.load(infile)
+    langlinks_index_path = disk_index_utils.get_sst_path(wiki_langlinks_path)
+    if os.path.exists(langlinks_index_path):
+        wiki_langlinks = disk_index_utils.LanglinksIndex(langlinks_index_path)
+    else:
+        with open(wiki_langlinks_path, 'rb') as infile:
+            wiki_langlinks = pickle.load(infile)
 
     print('Wikipedia parallel titles loaded')
 
-    # load spaCy models
-    spacy_models = mwep_settings['spacy_models']
-    models = {}
-    for model_info in spacy_models.split(';'):
-        language, model_name = model_info.split('-')
-        models[language] = spacy.load(model_name)
-
-    print("Spacy models have been loaded.")
+    # spaCy models are loaded when the first text of a language is processed
+    models = pilot_utils.ModelRegistry(mwep_settings['spacy_models'])
+    spacy_batch_size = mwep_settings['spacy_batch_size']
+    spacy_n_process = mwep_settings['spacy_n_process']
+    # forking is not safe while other event types or other pipeline steps are processed by threads
+    streaming = mwep_settings['pipeline']['streaming'] and not incremental
+    if mwep_settings['event_type_workers'] > 1 or streaming:
+        wu.mp_start_method = 'spawn'
+        if spacy_n_process > 1:
+            print('spacy_n_process is set to 1, since event_type_workers is larger than 1 or streaming is used')
+            spacy_n_process = 1
 
     end_init = time.time()
     print('Init phase done. Time needed to initialize the extractor', utils.format_time(end_init - start_init), 'sec')
@@ -251,161 +883,14 @@ if __name__ == '__main__':
 
     pilot_collections = []
 
-    for incident_type_uri in event_types:
-
-        incident_type = incident_type_uri
-
-        pilot_and_languages = languages + ['pilot']
-
-        inc_stats = [incident_type_uri, ','.join(languages)]
-
-        print('\n\n\n')
-        print('----- INCIDENT TYPE: %s -----' % incident_type_uri)
-        print('\n\n')
-
-        start = time.time()
-
-        # Query SPARQL and the API to get incidents, their properties, and labels.
-        incidents = retrieve_incidents_per_type(incident_type_uri,
-                                                event_type_matching,
-                                                json_wd_to_sem,
-                                                99999)
-
-        if not len(incidents):
-            print('NO INCIDENTS FOUND FOR %s. Continuing to next type...')
-            continue
-
-        new_incidents = obtain_reference_texts(incidents, wiki_folder, wiki_uri2path_info, language2info)
-
-        collection = classes.IncidentCollection(incidents=new_incidents,
-                                                incident_type=incident_type,
-                                                incident_type_uri=incident_type_uri,
-                                                languages=languages)
-
-        output_file = utils.make_output_filename(bin_folder,
-                                                 incident_type_uri,
-                                                 languages)
-
-        with open(output_file, 'wb') as of:
-            pickle.dump(collection, of)
-
-        inc_stats.append(len(collection.incidents))
-
-        ttl_filename = '%s/%s_%s.ttl' % (rdf_folder, incident_type_uri, '_'.join(languages))
-        collection.serialize(ttl_filename)
-
-        after_extraction = time.time()
+    pipeline_settings = mwep_settings['pipeline']
 
-        pilots = pilot_utils.create_pilot_data(collection,
-                                               languages,
-                                               mwep_settings['processing']["must_have_all_languages"],
-                                               mwep_settings['processing']["must_have_english"],
-                                               mwep_settings['processing']["one_page_per_language"])
-
-        if len(pilots) > max_pilot_incidents:
-            pilots = list(pilots)[:max_pilot_incidents]
-            print(f'selected first {max_pilot_incidents} pilot incidents')
-
-        after_pilot_selection = time.time()
-
-        pilots = get_primary_rt_links(pilots)
-
-        after_primary_texts = time.time()
-
-        pilot_collection = classes.IncidentCollection(incidents=pilots,
-                                                      incident_type_uri=incident_type_uri,
-                                                      incident_type=incident_type,
-                                                      languages=languages)
-
-        pilot_collections.append(pilot_collection)
-
-        ttl_filename = '%s/%s_%s_pilot.ttl' % (rdf_folder, incident_type_uri, '_'.join(pilot_and_languages))
-        pilot_collection.serialize(ttl_filename)
-
-        if len(pilot_collection.incidents) == 0:
-            print('No pilot incidents for type %s' % incident_type_uri)
-        else:
-            print('start pilot data processing', datetime.now())
-
-        for incident_obj in pilot_collection.incidents:
-
-            # add primary text urls
-            if crawl_wikipedia_sources:
-                primary_text_urls = {primary_text_url
-                                     for ref_text_obj in incident_obj.reference_texts
-                                     for primary_text_url in ref_text_obj.primary_ref_texts}
-                primary_url_to_ref_text_obj = crawl_utils.get_ref_text_obj_of_primary_reference_texts(primary_text_urls,
-                                                                                                      timeout,
-                                                                                                      startswith=startswith,
-                                                                                                      accepted_languages=accepted_languages,
-                                                                                                      excluded_domains=excluded_domains,
-                                                                                                      title_required=True,
-                                                                                                      num_chars_range=num_chars_range,
-                                                                                                      illegal_substrings=illegal_substrings,
-                                                                                                      illegal_chars_in_title=illegal_chars_in_title,
-                                                                                                      verbose=verbose)
-
-                for url, primary_ref_text_obj in primary_url_to_ref_text_obj.items():
-                    incident_obj.reference_texts.append(primary_ref_text_obj)
-
-            # process with spaCy
-            for ref_text_obj in incident_obj.reference_texts:
-                wiki_title = ref_text_obj.name
-                language = ref_text_obj.language
-                annotations = ref_text_obj.annotations
-                text = ref_text_obj.content
-                uri = ref_text_obj.uri
-
-                prefix = language2info[language]['prefix']
-
-                # dct of document
-                if ref_text_obj.found_by == ['Wikipedia source']:
-                    if ref_text_obj.creation_date is not None:
-                        dct = ref_text_obj.creation_date
-                    else:
-                        dct = datetime(1,1,1)
-                else: # wikipedia page
-                    year, month, day = language2info[language]['year_month_day']
-                    dct = datetime(year, month, day)
-
-                print(ref_text_obj.name, ref_text_obj.uri, ref_text_obj.found_by, dct)
-
-                nlp = models[language]
-
-                pilot_utils.text_to_naf(wiki_title,
-                                        languages,
-                                        text,
-                                        uri,
-                                        annotations,
-                                        prefix,
-                                        language,
-                                        nlp,
-                                        dct,
-                                        output_folder=naf_output_folder,
-                                        wiki_langlinks=wiki_langlinks)
-
-        out_file = utils.make_output_filename(bin_folder, incident_type_uri, pilot_and_languages)
-
-        with open(out_file, 'wb') as of:
-            pickle.dump(pilot_collection, of)
-
-        # add Wikidata information to NAF (entities and coreferences layer)
-        xml_utils.add_wikidata_uris_to_naf_files(inc_coll_obj=collection,
-                                                 main_naf_folder=mwep_settings['naf_output_folder'],
-                                                 languages=accepted_languages,
-                                                 verbose=2)
-
-        inc_stats.append(len(pilot_collection.incidents))
-
-        end = time.time()
-
-        inc_stats.append(utils.format_time(after_extraction - start))
-        inc_stats.append(utils.format_time(after_pilot_selection - after_extraction))
-        inc_stats.append(utils.format_time(after_primary_texts - after_pilot_selection))
-        inc_stats.append(utils.format_time(end - after_primary_texts))
-        inc_stats.append(utils.format_time(end - start))
-
-        all_inc_stats.append(inc_stats)
+    with ThreadPoolExecutor(max_workers=mwep_settings['event_type_workers']) as executor:
+        # executor.map yields the results in the order of the event types
+        for inc_stats, pilot_collection in executor.map(process_or_resume_event_type, event_types):
+            if inc_stats is not None:
+                all_inc_stats.append(inc_stats)
+                pilot_collections.append(pilot_collection)
 
     json_utils.create_indices_from_bin(pilot_collections, project, json_folder)
 
@@ -416,4 +901,11 @@ if __name__ == '__main__':
     df = pd.DataFrame(all_inc_stats, columns=headers)
     print(df.to_csv(index=False))
 
+    print(utils.label_cache.stats())
+    if utils.response_cache is not None:
+        print(utils.response_cache.stats())
+    if crawl_utils.crawl_store is not None:
+        print(crawl_utils.crawl_store.stats())
+
+    end = time.time()
     print('TOTAL TIME TO RUN THE SCRIPT for', event_types, ':', utils.format_time(end - start_init), 'sec')
@@ -1,9 +1,8 @@
 from collections import defaultdict
 
+import http_utils
 import utils
 
-import requests
-
 for_encoding = 'é'
 WIKIDATA_PREFIX = 'http://www.wikidata.org/entity/'
 
@@ -23,7 +22,7 @@ def obtain_date_of_creation(titles, language):
             'format': 'json'
             }
     url='https://%s.wikipedia.org/w/api.php?' % language
-    r=requests.get(url, params=params)
+    r=http_utils.get(url, params=params)
     json_response=r.json()
     for page_id, page_info in json_response['query']['pages'].items():
         dates[page_info['title']]=page_info['revisions'][0]['timestamp']
@@ -45,7 +44,7 @@ def obtain_contributors(titles, language):
             'format': 'json'
             }
     url='https://%s.wikipedia.org/w/api.php?' % language
-    r=requests.get(url, params=params)
+    r=http_utils.get(url, params=params)
     json_response=r.json()
     for page_id, page_info in json_response['query']['pages'].items():
         c=[]
@@ -72,7 +71,7 @@ def obtain_wiki_page_titles(wdt_ids, languages, verbose=0):
         print(url)
         print(params)
 
-    r=requests.get(url, params=params)
+    r=http_utils.get(url, params=params)
     j=r.json()
 
     if verbose >= 4:
@@ -108,7 +107,7 @@ def adapt_extlinks(a_list):
     
 def obtain_results_from_api(url, params):
     try:
-        r=requests.get(url, params=params)
+        r=http_utils.get(url, params=params)
     except:
         print('Error with wikipage', url, params)
         return {}
@@ -117,31 +116,96 @@ def obtain_results_from_api(url, params):
         print(r.request.url)
     return j
 
-def obtain_primary_rt_links(title, lang):
+def query_with_continuation(url, params):
+    """
+    Perform a query of the MediaWiki API and follow the continuation parameters
+    (e.g., elcontinue) until all results have been obtained.
 
-    params_extlinks={
-            'format': 'json',
-            'action': 'query',
-            'prop': 'extlinks',
-            'titles': title,
-            'redirects': True,
-            'ellimit': 500
-            }
+    :rtype: generator
+    :return: generator of JSON responses
+    """
+    params = dict(params)
+    while True:
+        j = obtain_results_from_api(url, params)
+        yield j
+        if 'continue' not in j.keys():
+            break
+        params.update(j['continue'])
+
+def resolve_titles(query, titles):
+    """
+    Map the titles of a query to the titles of the pages in the response,
+    using the normalized and redirects information of the response.
+
+    :param dict query: the 'query' part of a response of the MediaWiki API
+    :param iterable titles: the titles that were queried
+
+    :rtype: dict
+    :return: title as queried -> title of the page in the response
+    """
+    normalized = {info['from']: info['to'] for info in query.get('normalized', [])}
+    redirects = {info['from']: info['to'] for info in query.get('redirects', [])}
+
+    title2page_title = {}
+    for title in titles:
+        page_title = normalized.get(title, title)
+        seen = {page_title}
+        while page_title in redirects:
+            page_title = redirects[page_title]
+            if page_title in seen:
+                break
+            seen.add(page_title)
+        title2page_title[title] = page_title
+    return title2page_title
+
+def obtain_primary_rt_links_batch(titles, lang):
+    """
+    Obtain the external links of a number of Wikipedia pages of one language.
+    Up to 50 titles are sent in one request and continuation is followed,
+    hence pages with more than 500 external links are complete.
+
+    :param iterable titles: Wikipedia page titles
+    :param str lang: language of the Wikipedia, e.g., 'nl'
 
+    :rtype: dict
+    :return: title -> list of external links
+    """
     url='https://%s.wikipedia.org/w/api.php?' % lang
 
-    j_el=obtain_results_from_api(url, params_extlinks)
-    if 'query' not in j_el.keys(): 
-        print('no query for this page')
-        return []
+    title2links = {}
+    for batch in utils.split_in_batches(sorted(set(titles)), 50):
+        params_extlinks={
+                'format': 'json',
+                'action': 'query',
+                'prop': 'extlinks',
+                'titles': '|'.join(batch),
+                'redirects': True,
+                'ellimit': 500
+                }
 
-    for page_id, page_info in j_el['query']['pages'].items():
-        if page_id=='-1': continue
+        title2page_title = {}
+        page_title2links = defaultdict(list)
+        for j_el in query_with_continuation(url, params_extlinks):
+            if 'query' not in j_el.keys():
+                print('no query for these pages')
+                break
+
+            title2page_title.update(resolve_titles(j_el['query'], batch))
+
+            for page_id, page_info in j_el['query']['pages'].items():
+                if 'missing' in page_info or 'invalid' in page_info: continue
 
-        if 'extlinks' in page_info.keys():
-            els=adapt_extlinks(page_info['extlinks'])
-            return els
-    return []
+                if 'extlinks' in page_info.keys():
+                    page_title2links[page_info['title']].extend(adapt_extlinks(page_info['extlinks']))
+
+        for title in batch:
+            title2links[title] = page_title2links.get(title2page_title.get(title, title), [])
+
+    return title2links
+
+def obtain_primary_rt_links(title, lang):
+    """Obtain the external links of one Wikipedia page (see obtain_primary_rt_links_batch)."""
+    return obtain_primary_rt_links_batch([title], lang)[title]
 
 def obtain_wiki_page_info(title, lang, props, extract_text=True, other_languages=set()):
     """Obtain information for a Wikipedia page title. The requested pieces of information are defined in the `props` parameter."""
@@ -205,23 +269,52 @@ def obtain_wiki_page_info(title, lang, props, extract_text=True, other_languages
     return data
 
 def get_uri_from_title(name, lang):
+    """Obtain the canonical url of one Wikipedia page (see get_uris_from_titles)."""
+    return get_uris_from_titles([name], lang)[name]
 
-    URL = "https://%s.wikipedia.org/w/api.php" % lang
+def get_uris_from_titles(names, lang):
+    """
+    Obtain the canonical urls of a number of Wikipedia pages of one language,
+    using one request per 50 titles. Normalized and redirected titles are mapped back to the queried titles.
+    If the API does not provide a url, it is created from the title.
 
-    PARAMS = {
-    "action": "query",
-    "format": "json",
-    "titles": name,
-    "prop": "info",
-    "inprop": "url|talkid"
-    }
+    :param iterable names: Wikipedia page titles
+    :param str lang: language of the Wikipedia, e.g., 'nl'
 
-    j=obtain_results_from_api(URL, PARAMS)
-    for page_id, page_info in j['query']['pages'].items():
-        if page_id=='-1': continue
-        return page_info['canonicalurl']
-    invented_uri="https://%s.wikipedia.org/wiki/%s" % (lang, name.replace(' ', '_'))
-    return invented_uri
+    :rtype: dict
+    :return: title -> url
+    """
+    URL = "https://%s.wikipedia.org/w/api.php" % lang
+
+    name2uri = {}
+    for batch in utils.split_in_batches(sorted(set(names)), 50):
+        PARAMS = {
+        "action": "query",
+        "format": "json",
+        "titles": '|'.join(batch),
+        "redirects": True,
+        "prop": "info",
+        "inprop": "url|talkid"
+        }
+
+        title2page_title = {}
+        page_title2uri = {}
+        for j in query_with_continuation(URL, PARAMS):
+            if 'query' not in j.keys():
+                break
+
+            title2page_title.update(resolve_titles(j['query'], batch))
+
+            for page_id, page_info in j['query'].get('pages', {}).items():
+                if 'missing' in page_info or 'invalid' in page_info: continue
+                if 'canonicalurl' in page_info:
+                    page_title2uri[page_info['title']] = page_info['canonicalurl']
+
+        for name in batch:
+            invented_uri="https://%s.wikipedia.org/wiki/%s" % (lang, name.replace(' ', '_'))
+            name2uri[name] = page_title2uri.get(title2page_title.get(name, name), invented_uri)
+
+    return name2uri
 
 
 def map_wd_uri_to_wikipedia_uri(uris,
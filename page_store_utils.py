@@ -0,0 +1,116 @@
+import bz2
+import json
+import os
+import struct
+import zlib
+
+for_encoding = 'é'
+PAGE_STORE_FOLDER = 'page_store'
+OFFSET_FORMAT = '<Q'
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+OFFSET_PAIR_FORMAT = '<2Q'
+
+
+def get_store_paths(wiki_folder, relative_path):
+    """
+    Obtain the paths of the page store files of one Wikipedia shard.
+
+    :param str wiki_folder: path to where extracted Wikipedia output is stored
+    :param str relative_path: path of the bz2 shard relative to wiki_folder,
+    as stored in page2path.p
+
+    :rtype: tuple
+    :return: (path to the compressed pages, path to the byte offsets)
+    """
+    base = os.path.join(wiki_folder, PAGE_STORE_FOLDER, relative_path)
+    return f'{base}.pages', f'{base}.offsets'
+
+
+def store_exists(wiki_folder, relative_path):
+    """
+    Check whether a bz2 shard has been converted to the page store.
+    The offsets file is written last, hence its existence marks a complete conversion.
+    """
+    pages_path, offsets_path = get_store_paths(wiki_folder, relative_path)
+    return os.path.exists(offsets_path)
+
+
+def convert_shard(wiki_folder, relative_path, verbose=0):
+    """
+    Convert one bz2 shard of the Wikipedia Reader output to the page store.
+    Every line (one JSON Wikipedia page) is compressed separately
+    and the byte offset of every line is stored in a separate file,
+    such that a page can be loaded without decompressing the preceding ones.
+
+    :param str wiki_folder: path to where extracted Wikipedia output is stored
+    :param str relative_path: path of the bz2 shard relative to wiki_folder
+
+    :rtype: int
+    :return: number of pages in the shard
+    """
+    pages_path, offsets_path = get_store_paths(wiki_folder, relative_path)
+    os.makedirs(os.path.dirname(pages_path), exist_ok=True)
+
+    offset = 0
+    offsets = []
+    with bz2.BZ2File(os.path.join(wiki_folder, relative_path), 'r') as infile, \
+            open(pages_path, 'wb') as outfile:
+        for line in infile:
+            compressed = zlib.compress(line)
+            offsets.append(offset)
+            outfile.write(compressed)
+            offset += len(compressed)
+    offsets.append(offset)
+
+    tmp_offsets_path = f'{offsets_path}.tmp'
+    with open(tmp_offsets_path, 'wb') as outfile:
+        for offset in offsets:
+            outfile.write(struct.pack(OFFSET_FORMAT, offset))
+    os.replace(tmp_offsets_path, offsets_path)
+
+    if verbose >= 3:
+        print(f'converted {len(offsets) - 1} pages of {relative_path}')
+
+    return len(offsets) - 1
+
+
+def convert_wiki_folder(wiki_folder, wiki_uri2path_info, overwrite=False, verbose=0):
+    """
+    Convert all bz2 shards referred to in the page2path.p index to the page store.
+
+    :param str wiki_folder: path to where extracted Wikipedia output is stored
+    :param dict wiki_uri2path_info: Wikipedia uri -> (relative_path, line_number)
+    :param bool overwrite: if False, shards that are already converted are skipped
+    """
+    relative_paths = sorted({relative_path
+                             for relative_path, line_number in wiki_uri2path_info.values()})
+
+    num_converted = 0
+    for relative_path in relative_paths:
+        if not overwrite and store_exists(wiki_folder, relative_path):
+            continue
+        convert_shard(wiki_folder, relative_path, verbose=verbose)
+        num_converted += 1
+
+    if verbose >= 1:
+        print(f'converted {num_converted} of {len(relative_paths)} shards to the page store')
+
+
+def load_page(wiki_folder, relative_path, line_number):
+    """
+    Load one Wikipedia page from the page store using two seeks.
+
+    :rtype: dict
+    :return: the JSON Wikipedia page, e.g., with the keys 'text' and 'annotations'
+    """
+    pages_path, offsets_path = get_store_paths(wiki_folder, relative_path)
+
+    with open(offsets_path, 'rb') as infile:
+        infile.seek(line_number * OFFSET_SIZE)
+        start, end = struct.unpack(OFFSET_PAIR_FORMAT, infile.read(2 * OFFSET_SIZE))
+
+    with open(pages_path, 'rb') as infile:
+        infile.seek(start)
+        compressed = infile.read(end - start)
+
+    return json.loads(zlib.decompress(compressed))
@@ -1,10 +1,12 @@
 import json
 import os
 import re
-import time
+import threading
 import urllib.parse
+from collections import defaultdict
 from datetime import datetime
 
+import spacy
 import spacy_to_naf
 from lxml import etree
 
@@ -14,10 +16,78 @@ import xml_utils
 
 eventtype2json = {}
 for_encoding = 'é'
+NAF_LAYERS = {'raw', 'text', 'terms', 'deps'}
+LAYER2COMPONENTS = {
+    'terms': {'tagger'},
+    'deps': {'parser'},
+    'entities': {'ner', 'entity_ruler', 'entity_linker'},
+    'textcat': {'textcat'}
+}
 
 
 # , 'tennis tournament': 'tennis tournament'}
 
+def get_components_to_disable(layers):
+    """
+    Obtain the spaCy pipeline components that are not needed to create the NAF layers.
+
+    :param set layers: NAF layers, e.g., {'raw', 'text', 'terms', 'deps'}
+
+    :rtype: list
+    :return: names of pipeline components, e.g., ['ner', 'entity_ruler', 'entity_linker', 'textcat']
+    """
+    needed = set()
+    for layer in layers:
+        needed.update(LAYER2COMPONENTS.get(layer, set()))
+
+    return sorted({component
+                   for components in LAYER2COMPONENTS.values()
+                   for component in components} - needed)
+
+
+class ModelRegistry:
+    """
+    Mapping from language to spaCy model.
+    A model is only loaded when its language is requested for the first time,
+    without the pipeline components that are not needed for the NAF layers.
+    The registry can be shared by threads: a model is loaded once,
+    and a model should only be used by the thread that holds the lock of its language (see method "get_lock").
+    """
+
+    def __init__(self, spacy_models, layers=NAF_LAYERS):
+        """
+        :param str spacy_models: e.g., "en-en_core_web_sm;nl-nl_core_news_sm"
+        :param set layers: NAF layers that will be created
+        """
+        self.language2model_name = {}
+        for model_info in spacy_models.split(';'):
+            language, model_name = model_info.split('-')
+            self.language2model_name[language] = model_name
+
+        self.disable = get_components_to_disable(layers)
+        self.models = {}
+        self.lock = threading.Lock()
+        self.language2lock = {language: threading.Lock() for language in self.language2model_name}
+
+    def __getitem__(self, language):
+        with self.lock:
+            if language not in self.models:
+                model_name = self.language2model_name[language]
+                self.models[language] = spacy.load(model_name, disable=self.disable)
+                print(f'Spacy model {model_name} has been loaded (disabled: {", ".join(self.disable)})')
+            return self.models[language]
+
+    def get_lock(self, language):
+        """
+        :rtype: threading.Lock
+        :return: the lock that a thread should hold while it uses the model of a language
+        """
+        return self.language2lock[language]
+
+    def __contains__(self, language):
+        return language in self.language2model_name
+
+
 def remove_incidents_with_missing_FEs(incidents, event_type):
     new_incidents = []
 
@@ -74,8 +144,7 @@ def create_pilot_data(data,
                       must_have_english,
                       one_page_per_language):
     pilot_incidents = set()
-
-    cached = {}
+    ref_texts_without_uri = []
 
     data.incidents = remove_incidents_with_missing_FEs(data.incidents, data.incident_type)
     for incident in data.incidents:
@@ -99,25 +168,43 @@ def create_pilot_data(data,
 
         for ref_text in incident.reference_texts:
             if not ref_text.uri:
-                ref_text.uri = api.get_uri_from_title(ref_text.name, ref_text.language)
+                ref_texts_without_uri.append(ref_text)
         pilot_incidents.add(incident)
+
+    # obtain the labels of the extra_info values without a label in bulk
+    q_ids = {v.split('/')[-1]
+             for incident in pilot_incidents
+             for v_set in incident.extra_info.values()
+             for v in v_set
+             if '|' not in v and v.startswith('http')}
+    q_id2label = utils.obtain_labels(q_ids)
+
+    for incident in pilot_incidents:
         for p, v_set in incident.extra_info.items():
             new_v_set = set()
             for v in v_set:
                 if '|' not in v:
                     label = ''
                     q_id = v.split('/')[-1]
-                    if q_id in cached.keys():
-                        label = cached[q_id]
-                    elif v.startswith('http'):
-                        label = utils.obtain_label(q_id)
-                        time.sleep(1)
-                        cached[q_id] = label
+                    if v.startswith('http'):
+                        label = q_id2label[q_id]
                     v += ' | ' + label
                     new_v_set.add(v)
                 else:
                     new_v_set.add(v)
             incident.extra_info[p] = new_v_set
+
+    # obtain the uris of the reference texts in bulk per language
+    language2titles = defaultdict(set)
+    for ref_text in ref_texts_without_uri:
+        language2titles[ref_text.language].add(ref_text.name)
+
+    language2title2uri = {language: api.get_uris_from_titles(titles, language)
+                          for language, titles in language2titles.items()}
+
+    for ref_text in ref_texts_without_uri:
+        ref_text.uri = language2title2uri[ref_text.language][ref_text.name]
+
     print('Num of pilot incidents', len(pilot_incidents))
     return pilot_incidents
 
@@ -227,6 +314,14 @@ def add_hyperlinks(naf, annotations, prefix, language, dct, wiki_langlinks={}, v
                                         add_comments=True)
 
 
+def get_naf_path(output_folder, language, wiki_title):
+    """
+    :rtype: str
+    :return: path of the NAF file of a text, e.g., wiki_output/en/2010 Haiti earthquake.naf
+    """
+    return os.path.join(output_folder, language, f'{wiki_title}.naf')
+
+
 def text_to_naf(wiki_title,
                 target_languages,
                 text,
@@ -250,7 +345,7 @@ def text_to_naf(wiki_title,
         naf = spacy_to_naf.text_to_NAF(text=text,
                                        nlp=nlp,
                                        dct=dct,
-                                       layers={'raw', 'text', 'terms', 'deps'},
+                                       layers=NAF_LAYERS,
                                        naf_version='v3.1',
                                        title=wiki_title,
                                        uri=wiki_uri,
@@ -277,10 +372,97 @@ def text_to_naf(wiki_title,
         lang_dir = os.path.join(output_folder, language)
         if not os.path.exists(lang_dir):
             os.mkdir(lang_dir)
-        output_path = os.path.join(lang_dir, f'{wiki_title}.naf')
-        spacy_to_naf.NAF_to_file(naf, output_path)
+        output_path = get_naf_path(output_folder, language, wiki_title)
+        tmp_output_path = f'{output_path}.tmp'
+        spacy_to_naf.NAF_to_file(naf, tmp_output_path)
+        os.replace(tmp_output_path, output_path) # a NAF file only exists once it has been written completely
 
     if verbose >= 3:
         print(f'saved to {output_path}')
 
     return naf
+
+
+class ParsedText:
+    """
+    Wrapper around a spaCy model that returns an already parsed Doc for one text.
+    This enables spacy_to_naf.text_to_NAF to make use of Docs that are parsed in batches by nlp.pipe.
+    """
+
+    def __init__(self, nlp, text, doc):
+        self.nlp = nlp
+        self.text = text
+        self.doc = doc
+
+    def __call__(self, text):
+        if text == self.text:
+            return self.doc
+        return self.nlp(text)
+
+    def __getattr__(self, attr):
+        return getattr(self.nlp, attr)
+
+
+def texts_to_naf(naf_jobs,
+                 target_languages,
+                 models,
+                 batch_size=50,
+                 n_process=1,
+                 output_folder=None,
+                 wiki_langlinks={},
+                 skip_existing=False,
+                 owner=None,
+                 verbose=0):
+    """
+    Parse texts with spaCy in batches (nlp.pipe), grouped by language,
+    and convert the resulting Docs to NAF (see function "text_to_naf").
+
+    :param list naf_jobs: list of dicts with the keys
+    wiki_title, text, wiki_uri, annotations, prefix, language, and dct
+    :param list target_languages: see function "text_to_naf"
+    :param ModelRegistry models: language -> spaCy model
+    :param int batch_size: number of texts in one nlp.pipe batch
+    :param int n_process: number of processes used by nlp.pipe
+    (if larger than 1, spaCy >= 2.2.2 is required)
+    :param bool skip_existing: if True, the texts of which the NAF file exists in output_folder are skipped,
+    e.g., when resuming an interrupted run
+    :param owner: if provided, the texts of which the NAF file is claimed by another owner,
+    e.g., another event type that is processed at the same time, are skipped (see function "xml_utils.claim_naf_path")
+    """
+    language2naf_jobs = defaultdict(list)
+    num_skipped = 0
+    num_claimed = 0
+    for naf_job in naf_jobs:
+        if not isinstance(naf_job['text'], str):
+            continue
+        if output_folder is not None:
+            naf_path = get_naf_path(output_folder, naf_job['language'], naf_job['wiki_title'])
+            if owner is not None and not xml_utils.claim_naf_path(naf_path, owner):
+                num_claimed += 1
+                continue
+            if skip_existing and os.path.exists(naf_path):
+                num_skipped += 1
+                continue
+        language2naf_jobs[naf_job['language']].append(naf_job)
+
+    if num_skipped:
+        print(f'skipped {num_skipped} texts of which the NAF file exists')
+    if num_claimed:
+        print(f'skipped {num_claimed} texts of which the NAF file is written by another event type')
+
+    pipe_kwargs = {'batch_size': batch_size}
+    if n_process > 1:
+        pipe_kwargs['n_process'] = n_process
+
+    for language, language_naf_jobs in language2naf_jobs.items():
+        nlp = models[language]
+        with models.get_lock(language):
+            docs = nlp.pipe((naf_job['text'] for naf_job in language_naf_jobs), **pipe_kwargs)
+
+            for naf_job, doc in zip(language_naf_jobs, docs):
+                text_to_naf(target_languages=target_languages,
+                            nlp=ParsedText(nlp, naf_job['text'], doc),
+                            output_folder=output_folder,
+                            wiki_langlinks=wiki_langlinks,
+                            verbose=verbose,
+                            **naf_job)
@@ -0,0 +1,82 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+
+for_encoding = 'é'
+END_OF_STREAM = object()
+
+
+def run_pipeline(items, stages, queue_size=2, stage2time=None):
+    """
+    Run items through a sequence of stages.
+    Every stage runs in its own thread and is connected to the next stage by a bounded queue,
+    hence the stages process different items at the same time, e.g., a network-bound stage
+    retrieves the next chunk of incidents while a CPU-bound stage parses the current chunk.
+    A stage blocks if the queue to the next stage is full (backpressure),
+    such that at most queue_size items are waiting between two stages.
+
+    If a stage raises an exception, the remaining items are skipped and the exception is raised
+    after all threads have finished.
+
+    :param iterable items: the input of the first stage, e.g., chunks of incidents
+    :param list stages: list of (name, function) tuples.
+    Every function is called with the output of the previous stage.
+    :param int queue_size: maximum number of items waiting between two stages
+    :param dict stage2time: if provided, the number of seconds that every stage was busy is added to it
+    (name -> seconds)
+
+    :rtype: list
+    :return: the outputs of the last stage, in the order of the items
+    """
+    if stage2time is None:
+        stage2time = defaultdict(float)
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    errors = []
+
+    def feed():
+        for item in items:
+            if errors:
+                break
+            queues[0].put(item)
+        queues[0].put(END_OF_STREAM)
+
+    def work(name, function, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is END_OF_STREAM:
+                out_queue.put(END_OF_STREAM)
+                return
+            if errors:  # skip the remaining items, but keep emptying the queue
+                continue
+            try:
+                start = time.time()
+                output = function(item)
+                stage2time[name] = stage2time.get(name, 0.0) + time.time() - start
+                out_queue.put(output)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for index, (name, function) in enumerate(stages):
+        threads.append(threading.Thread(target=work,
+                                        args=(name, function, queues[index], queues[index + 1]),
+                                        daemon=True))
+    for thread in threads:
+        thread.start()
+
+    outputs = []
+    while True:
+        output = queues[-1].get()
+        if output is END_OF_STREAM:
+            break
+        outputs.append(output)
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return outputs
@@ -1,6 +1,8 @@
 import shutil
+import hashlib
+import json
 import os.path
-import requests
+import re
 from collections import defaultdict
 import time
 from datetime import datetime
@@ -9,9 +11,20 @@ import networkx as nx
 from glob import glob
 import os
 
+import cache_utils
+import http_utils
+
+try:
+    import ijson
+except ImportError: # the SPARQL results are then parsed at once (see function "iter_bindings_with_retry")
+    ijson = None
+
 for_encoding = 'é'
 wdt_sparql_url = 'https://query.wikidata.org/sparql'
 WIKIDATA_PREFIX = 'http://www.wikidata.org/entity/'
+label_cache = None # if set to a cache_utils.LabelCache, it is used by obtain_labels
+response_cache = None # if set to a cache_utils.ResponseCache, it is used by get_results_with_retry
+MAX_GET_QUERY_LENGTH = 2000 # longer queries are sent with POST (see function "send_query")
 
 def format_time(t):
     """
@@ -26,6 +39,40 @@ def make_output_filename(bindir, incident_type, languages):
     output_file='%s/%s_%s.bin' % (bindir, incident_type, ','.join(sorted(languages)))
     return output_file
 
+def make_checkpoint_filename(bindir, incident_type, languages, stage):
+    """
+    Create the filename of the checkpoint of a stage, next to the output file (see make_output_filename),
+    e.g., bin/Q40231_en,nl.incidents.ckpt
+    """
+    checkpoint_file='%s/%s_%s.%s.ckpt' % (bindir, incident_type, ','.join(sorted(languages)), stage)
+    return checkpoint_file
+
+def remove_checkpoints(bindir, incident_type, languages, stages):
+    """
+    Remove the checkpoints of the stages of an incident type, if existing.
+    """
+    for stage in stages:
+        checkpoint_file=make_checkpoint_filename(bindir, incident_type, languages, stage)
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+
+def dump_pickle(obj, path):
+    """
+    Pickle an object to a temporary file that replaces path when it has been written completely,
+    such that an interrupted run never leaves a partial file behind.
+    """
+    tmp_path='%s.tmp' % path
+    with open(tmp_path, 'wb') as outfile:
+        pickle.dump(obj, outfile)
+    os.replace(tmp_path, path)
+
+def load_pickle(path):
+    """
+    Load a pickled object.
+    """
+    with open(path, 'rb') as infile:
+        return pickle.load(infile)
+
 def remove_and_create_folder(fldr):
     """
     Remove a folder, if existing, and re-create it.
@@ -39,57 +86,236 @@ def split_in_batches(a_list, batch_size=500):
     for i in range(0, len(a_list), batch_size):
         yield a_list[i:i + batch_size]
 
+def send_query(wdt_sparql_url, query, **kwargs):
+    """
+    Send a SPARQL query with GET, or with POST if the query is longer than MAX_GET_QUERY_LENGTH characters,
+    e.g., a query with a large VALUES clause, since a long url can be rejected by the endpoint (414).
+
+    :rtype: requests.Response
+    """
+    if len(query) > MAX_GET_QUERY_LENGTH:
+        return http_utils.post(wdt_sparql_url, data={'query': query}, params={'format': 'json'}, **kwargs)
+    return http_utils.get(wdt_sparql_url, params={'format': 'json', 'query': query}, **kwargs)
+
+def is_client_error(e):
+    """
+    :rtype: bool
+    :return: whether an error is caused by a response with a 4xx status code other than 429 (too many requests),
+    i.e., an error of the query that retrying does not solve
+    """
+    response = getattr(e, 'response', None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code != 429
+
 def get_results_with_retry(wdt_sparql_url, query):
     """
     Run SPARQL query multiple times until the results are there.
+    If response_cache is set, a cached response of the same query is returned if it is recent enough.
+
+    :raises requests.HTTPError: if the endpoint rejects the query (see function "is_client_error")
     """
+    if response_cache is not None:
+        response = response_cache.get(wdt_sparql_url, query)
+        if response is not None:
+            return response
+
     while True:
         try:
-            r = requests.get(wdt_sparql_url,
-                     params = {'format': 'json', 'query': query})
+            r = send_query(wdt_sparql_url, query)
+            r.raise_for_status()
         #    res_text=r.text
         #    response = json.loads(res_text)
             response = r.json()
             break
         except Exception as e:
+            if is_client_error(e):
+                raise
             print(e, 'error, retrying')
             time.sleep(2)
             continue
+
+    if response_cache is not None:
+        response_cache.put(wdt_sparql_url, query, response)
     return response
 
-def obtain_label(wd_id):
+def iter_bindings_with_retry(wdt_sparql_url, query, on_restart=None):
+    """
+    Run SPARQL query and yield the result bindings while the response is being parsed,
+    such that the raw response is never completely in memory.
+    If response_cache is set, a cached response of the same query is parsed instead if it is recent enough,
+    and otherwise the response is written to the cache while it is being received.
+    A cached response that can not be parsed is removed, after which the query is sent.
+
+    The query is sent with GET or POST (see function "send_query") and retried until the complete response
+    has been parsed, unless the endpoint rejects the query (see function "is_client_error").
+    If an error occurs after bindings have been yielded, the query is restarted and all bindings
+    are yielded again, hence the caller should process the bindings idempotently (see function "index_results_by_id").
+
+    The number of concurrent requests per host (see http_utils.request) bounds the requests,
+    not the time that is needed to receive and parse the response.
+
+    If ijson is not installed, the bindings of get_results_with_retry are yielded.
+
+    :param callable on_restart: if provided, it is called before the bindings are yielded again
+
+    :raises requests.HTTPError: if the endpoint rejects the query
+    """
+    if ijson is None:
+        yield from get_results_with_retry(wdt_sparql_url, query)['results']['bindings']
+        return
+
+    num_yielded = 0
+    if response_cache is not None:
+        infile = response_cache.open(wdt_sparql_url, query)
+        if infile is not None:
+            try:
+                with infile:
+                    for binding in ijson.items(infile, 'results.bindings.item'):
+                        num_yielded += 1
+                        yield binding
+                return
+            except Exception as e: # truncated or corrupt file
+                print(e, 'corrupt cached response, removing it')
+                response_cache.remove(wdt_sparql_url, query)
+
+    while True:
+        if num_yielded and on_restart is not None:
+            on_restart()
+        num_yielded = 0
+        writer = None
+        try:
+            with send_query(wdt_sparql_url, query, stream=True) as r:
+                r.raise_for_status()
+                r.raw.decode_content = True
+
+                stream = r.raw
+                if response_cache is not None:
+                    writer = response_cache.open_writer(wdt_sparql_url, query)
+                    stream = cache_utils.TeeReader(r.raw, writer)
+
+                for binding in ijson.items(stream, 'results.bindings.item'):
+                    num_yielded += 1
+                    yield binding
+
+                if writer is not None:
+                    stream.read_remainder()
+                    writer.commit()
+            break
+        except Exception as e:
+            if is_client_error(e):
+                raise
+            print(e, 'error, retrying')
+            time.sleep(2)
+            continue
+        finally:
+            if writer is not None:
+                writer.discard()
+
+def obtain_label(wd_id, language='en'):
     """
     Obtain an English label for a property of Wikidata.
     """
-    query = """
-    SELECT ?label WHERE {
-    wd:%s rdfs:label ?label . 
-    FILTER(LANG(?label) = "" || LANGMATCHES(LANG(?label), "en"))
-    }
-    LIMIT 1
-    """ % wd_id
+    return obtain_labels([wd_id], language=language)[wd_id]
 
-    response=get_results_with_retry(wdt_sparql_url, query) 
+def obtain_labels(wd_ids, batch_size=200, language='en'):
+    """
+    Obtain labels for a number of Wikidata items,
+    using one SPARQL query (with a VALUES clause) per batch of identifiers.
+    If label_cache is set, labels are first looked up in the cache,
+    and the labels that are fetched are added to it.
 
-    results=response['results']['bindings']
-    if not len(results):
-        return ''
-    the_label=results[0]['label']['value']
-    return the_label
+    :param iterable wd_ids: Wikidata identifiers, e.g., ['Q31', 'Q55']
+    :param int batch_size: number of identifiers per query
+    :param str language: language of the labels
 
-def construct_and_run_query(type_qid,
-                            event_type_matching,
-                            languages,
-                            more_props,
-                            limit):
+    :rtype: dict
+    :return: identifier -> label ('' if no label was found)
     """
-    Construct a wikidata query to obtain all events of a specific type with their structured data, then run this query.
+    wd_id2label = {wd_id: '' for wd_id in wd_ids}
+
+    cached = {}
+    if label_cache is not None:
+        cached = label_cache.get_many(wd_id2label.keys(), language=language)
+        wd_id2label.update(cached)
+
+    to_fetch = [wd_id for wd_id in wd_id2label
+                if wd_id not in cached and re.match(r'^[A-Za-z0-9_-]+$', wd_id)]
+
+    fetched = {}
+    for batch in split_in_batches(sorted(to_fetch), batch_size):
+        values = ' '.join('<%s%s>' % (WIKIDATA_PREFIX, wd_id) for wd_id in batch)
+        query = """
+        SELECT ?item ?label WHERE {
+        VALUES ?item { %s }
+        ?item rdfs:label ?label .
+        FILTER(LANG(?label) = "" || LANGMATCHES(LANG(?label), "%s"))
+        }
+        """ % (values, language)
+
+        response=get_results_with_retry(wdt_sparql_url, query)
+
+        batch_wd_id2label = {wd_id: '' for wd_id in batch}
+        for result in response['results']['bindings']:
+            wd_id = result['item']['value'].replace(WIKIDATA_PREFIX, '')
+            if not batch_wd_id2label.get(wd_id):
+                batch_wd_id2label[wd_id] = result['label']['value']
+        fetched.update(batch_wd_id2label)
+
+    wd_id2label.update(fetched)
+    if label_cache is not None:
+        label_cache.put_many(fetched, language=language)
+
+    return wd_id2label
+
+def get_lang2var(languages):
+    """
+    :rtype: dict
+    :return: language -> SPARQL variable of the label in that language, e.g., 'en' -> '?label_en'
     """
-    
     lang2var={}
     for l in languages:
         var='?label_%s' % l
         lang2var[l]=var
+    return lang2var
+
+def get_property_vars(type_qid, more_props):
+    """
+    :rtype: list
+    :return: list of (SPARQL variable, property path, whether the label variable is requested),
+    e.g., ('?P17', 'wdt:P17', True), one for every unique property path of the mappings
+    """
+    property_vars=[]
+    opt_vars=set()
+    for fn_role, wdt_prop_paths in more_props.items():
+        for a_path in wdt_prop_paths:
+            var='?' + a_path.replace('wdt:', '').replace('/', '_')       # fn_role.split('@')[-1]
+            if var not in opt_vars:
+                opt_vars.add(var)
+                property_vars.append((var, a_path, type_qid not in {"Q40231"}))
+    return property_vars
+
+def get_main_part(type_qid, event_type_matching):
+    """
+    :rtype: str
+    :return: the part of the query that matches the incidents of an event type and their direct types
+    """
+    if event_type_matching == 'direct_match':
+        main_part = f'?incident wdt:P31 wd:{type_qid} .\nBIND(wd:{type_qid} as ?direct_type) .'
+    elif event_type_matching == 'subsumed_by':
+        main_part = f'?incident wdt:P31*/wdt:P279* wd:{type_qid} ;\nwdt:P31 ?direct_type .'
+    return main_part
+
+def construct_query(type_qid,
+                    event_type_matching,
+                    languages,
+                    more_props):
+    """
+    Construct a wikidata query (without solution modifiers, e.g., limit) to obtain all events of a specific type with their structured data.
+
+    :rtype: tuple
+    :return: (query, lang2var, variables to order the results by)
+    """
+    
+    lang2var=get_lang2var(languages)
     return_langs=' '.join(lang2var.values())
     
     optional_clauses_str=""
@@ -100,22 +326,14 @@ def construct_and_run_query(type_qid,
     opt_vars=[]
     opt_var_labels=[]
     optional_more_info=""
-    for fn_role, wdt_prop_paths in more_props.items():
-        for a_path in wdt_prop_paths:
-            var='?' + a_path.replace('wdt:', '').replace('/', '_')       # fn_role.split('@')[-1]
-            if var not in opt_vars:
-                label_var=f"{var}Label"
-                clause=f"""OPTIONAL {{ \n\t?incident {a_path} {var} }}\n\t"""
-                optional_more_info+=clause
-                opt_vars.append(var)
-                if type_qid not in {"Q40231"}:
-                    opt_var_labels.append(var + 'Label')
+    for var, a_path, with_label in get_property_vars(type_qid, more_props):
+        clause=f"""OPTIONAL {{ \n\t?incident {a_path} {var} }}\n\t"""
+        optional_more_info+=clause
+        opt_vars.append(var)
+        if with_label:
+            opt_var_labels.append(var + 'Label')
 
-    
-    if event_type_matching == 'direct_match':
-        main_part = f'?incident wdt:P31 wd:{type_qid} .\nBIND(wd:{type_qid} as ?direct_type) .'
-    elif event_type_matching == 'subsumed_by':
-        main_part = f'?incident wdt:P31*/wdt:P279* wd:{type_qid} ;\nwdt:P31 ?direct_type .'
+    main_part = get_main_part(type_qid, event_type_matching)
 
     query = """
     SELECT DISTINCT ?direct_type ?incident ?incidentLabel %s %s %s WHERE {
@@ -123,31 +341,227 @@ def construct_and_run_query(type_qid,
       %s
       %s
       %s
-    } limit %d
-    """ % (return_langs,
+    }""" % (return_langs,
            ' '.join(opt_vars),
            ' '.join(opt_var_labels),
            main_part,
            optional_clauses_str,
-           optional_more_info,
-           limit)
+           optional_more_info)
+
+    # the labels are determined by the other variables, hence these variables order the results completely
+    order_vars = ['?incident', '?direct_type'] + list(lang2var.values()) + opt_vars
+
+    return query, lang2var, order_vars
+
+
+def construct_and_run_query(type_qid,
+                            event_type_matching,
+                            languages,
+                            more_props,
+                            limit,
+                            query_mode='single',
+                            page_size=10000,
+                            progress_folder=None,
+                            values_batch_size=500):
+    """
+    Construct a wikidata query to obtain all events of a specific type with their structured data, then run this query.
+
+    :param str query_mode: 'single': run one query | 'paged': run the query in pages of page_size results
+    (see function "run_paged_query") | 'split': run separate queries for the incidents, the labels, and every property
+    (see function "run_split_queries")
+    :param int page_size: number of results per page if query_mode is 'paged'
+    :param str progress_folder: if provided and query_mode is 'paged', progress is stored in this folder,
+    such that an interrupted run can resume from the last page
+    :param int values_batch_size: number of incidents per query (VALUES clause) if query_mode is 'split'
+    """
+    if query_mode == 'split':
+        return run_split_queries(type_qid,
+                                 event_type_matching,
+                                 languages,
+                                 more_props,
+                                 limit,
+                                 values_batch_size=values_batch_size)
+
+    query, lang2var, order_vars = construct_query(type_qid,
+                                                  event_type_matching,
+                                                  languages,
+                                                  more_props)
+
+    if query_mode == 'paged':
+        return run_paged_query(query,
+                               lang2var,
+                               more_props,
+                               order_vars,
+                               limit,
+                               page_size,
+                               progress_folder=progress_folder)
+
+    query += ' limit %d\n    ' % limit
 
     print('QUERY:\n', query)
 
-    response=get_results_with_retry(wdt_sparql_url, query)
-    
-    results=response['results']['bindings']
+    results=iter_bindings_with_retry(wdt_sparql_url, query)
 
     results_by_id=index_results_by_id(results, lang2var, more_props)
    
     return results_by_id
 
 
-def index_results_by_id(raw_results, lang2var, extra_info):
+def load_paged_query_progress(progress_path, lang2var, more_props, indexed_results):
+    """
+    Index the results of the pages that were stored by run_paged_query.
+    A page that was only partly written (e.g., because the run was interrupted) is removed from the file.
+
+    :param dict indexed_results: the results are indexed into this dict (see function "index_results_by_id")
+
+    :rtype: int
+    :return: number of stored results, i.e., the offset of the next page
+    """
+    offset=0
+    with open(progress_path, 'r+b') as infile:
+        while True:
+            position=infile.tell()
+            try:
+                page_results=pickle.load(infile)
+            except Exception: # end of the file or a partly written page
+                infile.truncate(position)
+                break
+            index_results_by_id(page_results, lang2var, more_props, indexed_results=indexed_results)
+            offset+=len(page_results)
+    return offset
+
+def run_paged_query(query,
+                    lang2var,
+                    more_props,
+                    order_vars,
+                    limit,
+                    page_size,
+                    progress_folder=None):
+    """
+    Run a query in pages (ORDER BY, LIMIT, and OFFSET) and index the results of every page
+    before the next page is requested.
+
+    :param str query: query without solution modifiers (see function "construct_query")
+    :param list order_vars: variables that order the results completely
+    :param int limit: maximum number of results in total
+    :param int page_size: number of results per page
+    :param str progress_folder: if provided, the results of every page are appended to a file in this folder,
+    such that the progress is stored in time proportional to the size of the page.
+    A run with the same query indexes the stored results and resumes at the next page.
+
+    :rtype: dict
+    :return: see function "index_results_by_id"
+    """
+    results_by_id=defaultdict(dict)
+    offset=0
+
+    progress_path=None
+    if progress_folder is not None:
+        os.makedirs(progress_folder, exist_ok=True)
+        query_hash=hashlib.sha256(f'{query}\n{limit}\n{page_size}'.encode('utf-8')).hexdigest()
+        progress_path=os.path.join(progress_folder, f'{query_hash}.pages')
+        if os.path.exists(progress_path):
+            offset=load_paged_query_progress(progress_path, lang2var, more_props, results_by_id)
+            print(f'resuming paged query at offset {offset}')
+
+    print('QUERY:\n', query)
+
+    while offset < limit:
+        num_results=min(page_size, limit - offset)
+        page_query='%s ORDER BY %s LIMIT %d OFFSET %d' % (query, ' '.join(order_vars), num_results, offset)
+
+        page_results=[]
+        for result in iter_bindings_with_retry(wdt_sparql_url, page_query, on_restart=page_results.clear):
+            index_results_by_id([result], lang2var, more_props, indexed_results=results_by_id)
+            page_results.append(result)
+
+        offset+=len(page_results)
+        print(f'indexed {offset} results of paged query, {len(results_by_id)} incidents')
+
+        if progress_path is not None:
+            with open(progress_path, 'ab') as outfile:
+                pickle.dump(page_results, outfile)
+
+        if len(page_results) < num_results:
+            break
+
+    if progress_path is not None and os.path.exists(progress_path):
+        os.remove(progress_path)
+
+    return results_by_id
+
+
+def run_split_queries(type_qid,
+                      event_type_matching,
+                      languages,
+                      more_props,
+                      limit,
+                      values_batch_size=500):
+    """
+    Obtain the same results as construct_and_run_query without the OPTIONAL clauses,
+    which multiply the number of results for every multi-valued property:
+    1. one query for the incidents and their direct types
+    2. per batch of incidents (VALUES clause): one query for the labels in every language
+    and one query for every property path
+
+    :param int values_batch_size: number of incidents per query
+
+    :rtype: dict
+    :return: see function "index_results_by_id"
+    """
+    lang2var=get_lang2var(languages)
+
+    query = """
+    SELECT DISTINCT ?direct_type ?incident WHERE {
+      %s
+    } limit %d
+    """ % (get_main_part(type_qid, event_type_matching),
+           limit)
+
+    print('QUERY:\n', query)
+
+    results_by_id=index_results_by_id(iter_bindings_with_retry(wdt_sparql_url, query), lang2var, more_props)
+
+    for batch in split_in_batches(sorted(results_by_id), values_batch_size):
+        values=' '.join('<%s>' % incident_uri for incident_uri in batch)
+
+        queries=[]
+        for l, var in lang2var.items():
+            queries.append("""
+            SELECT ?incident %s WHERE {
+              VALUES ?incident { %s }
+              ?incident rdfs:label %s .
+              FILTER ( LANGMATCHES ( LANG ( %s ), "%s" ))
+            }""" % (var, values, var, var, l))
+
+        for var, a_path, with_label in get_property_vars(type_qid, more_props):
+            queries.append("""
+            SELECT DISTINCT ?incident %s %s WHERE {
+              SERVICE wikibase:label { bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en". }
+              VALUES ?incident { %s }
+              ?incident %s %s .
+            }""" % (var, var + 'Label' if with_label else '', values, a_path, var))
+
+        for query in queries:
+            index_results_by_id(iter_bindings_with_retry(wdt_sparql_url, query),
+                                lang2var,
+                                more_props,
+                                indexed_results=results_by_id)
+
+        print(f'retrieved labels and properties of {len(batch)} incidents')
+
+    return results_by_id
+
+def index_results_by_id(raw_results, lang2var, extra_info, indexed_results=None):
     """
     Aggregate/index the SPARQL results by incident ID.
+
+    :param iterable raw_results: SPARQL result bindings, which can contain a subset of the variables
+    (see function "run_split_queries")
+    :param dict indexed_results: if provided, the results are merged into these indexed results
     """
-    indexed_results=defaultdict(dict)
+    if indexed_results is None:
+        indexed_results=defaultdict(dict)
     for entry in raw_results:
         wdt_id=entry['incident']['value']
         current_result=indexed_results[wdt_id]
@@ -156,12 +570,12 @@ def index_results_by_id(raw_results, lang2var, extra_info):
 
         if 'references' not in current_result:
             current_result['references']=defaultdict(str)
-        name=entry['incidentLabel']['value']
         #current_result['type_id']=entry['type_id']['value']
 
         if 'direct_types' not in current_result.keys():
             current_result['direct_types']=set()
-        current_result['direct_types'].add(entry['direct_type']['value'])
+        if 'direct_type' in entry.keys():
+            current_result['direct_types'].add(entry['direct_type']['value'])
 
         for l, var in lang2var.items():
             label_in_lang=var.strip('?')
@@ -183,6 +597,35 @@ def index_results_by_id(raw_results, lang2var, extra_info):
         indexed_results[wdt_id]=current_result
     return indexed_results
 
+def get_incident_signature(inc_data):
+    """
+    Compute a signature of the Wikidata information of an incident,
+    which changes if its direct types, labels, or properties change
+    (see function "add_sitelinks_to_signature" for its Wikipedia pages).
+
+    :param dict inc_data: the indexed results of one incident (see function "index_results_by_id")
+
+    :rtype: str
+    :return: SHA-256 hash of the information
+    """
+    info={'direct_types': sorted(inc_data['direct_types']),
+          'references': sorted(inc_data['references'].items()),
+          'extra_info': sorted((predicate, sorted(values)) for predicate, values in inc_data['extra_info'].items())}
+    return hashlib.sha256(json.dumps(info).encode('utf-8')).hexdigest()
+
+def add_sitelinks_to_signature(signature, sitelinks):
+    """
+    Extend the signature of an incident (see function "get_incident_signature") with its Wikipedia sitelinks,
+    such that it also changes if a Wikipedia page is added or renamed.
+
+    :param dict sitelinks: language -> Wikipedia title (see native_api_utils.obtain_wiki_page_titles)
+
+    :rtype: str
+    :return: SHA-256 hash of the signature and the sitelinks
+    """
+    info=[signature, sorted(sitelinks.items())]
+    return hashlib.sha256(json.dumps(info).encode('utf-8')).hexdigest()
+
 def get_languages_and_names(ref_texts):
     """Obtain list of languages and names in our reference texts."""
     found_names=[]
@@ -2,10 +2,15 @@ import bz2
 import json
 import os
 import urllib.parse
+from collections import defaultdict
+import multiprocessing
 
 from lxml import etree
+import page_store_utils
 import xml_utils
 
+mp_start_method = None # start method of the processes that load the shards, e.g., 'spawn' (None: the default)
+
 
 def load_annotations(annotations, prefix):
     """
@@ -53,6 +58,57 @@ def urlencode_wikititle(wiki_title, prefix=None):
 result = urlencode_wikititle('François Hollande', prefix='https://nl.wikipedia.org/wiki/')
 assert result == 'https://nl.wikipedia.org/wiki/Fran%C3%A7ois_Hollande'
 
+def load_pages_of_shard(wiki_folder, relative_path, line_numbers):
+    """
+    Load a number of Wikipedia pages from one shard.
+    If the shard has been converted to the page store, the pages are loaded directly,
+    else the bz2 file is decompressed once up to the highest requested line number.
+
+    :param str wiki_folder: path to where extracted Wikipedia output is stored
+    :param str relative_path: path of the bz2 shard relative to wiki_folder
+    :param iterable line_numbers: line numbers of the requested pages
+
+    :rtype: dict
+    :return: line_number -> JSON Wikipedia page
+    """
+    line_numbers = set(line_numbers)
+    line_number2page = {}
+
+    if page_store_utils.store_exists(wiki_folder, relative_path):
+        for line_number in sorted(line_numbers):
+            line_number2page[line_number] = page_store_utils.load_page(wiki_folder, relative_path, line_number)
+        return line_number2page
+
+    path = os.path.join(wiki_folder, relative_path)
+    last_line_number = max(line_numbers)
+    with bz2.BZ2File(path, "r") as infile:
+        for index, line in enumerate(infile):
+            if index in line_numbers:
+                line_number2page[index] = json.loads(line)
+            if index == last_line_number:
+                break
+
+    return line_number2page
+
+
+def load_pages_of_shards(wiki_folder, shard_requests):
+    """
+    Load the requested Wikipedia pages of a number of shards (the work of one retrieval worker).
+
+    :param str wiki_folder: path to where extracted Wikipedia output is stored
+    :param list shard_requests: list of (relative_path, line_numbers) tuples
+
+    :rtype: dict
+    :return: (relative_path, line_number) -> JSON Wikipedia page
+    """
+    path_info2page = {}
+    for relative_path, line_numbers in shard_requests:
+        line_number2page = load_pages_of_shard(wiki_folder, relative_path, line_numbers)
+        for line_number, wiki_page in line_number2page.items():
+            path_info2page[(relative_path, line_number)] = wiki_page
+    return path_info2page
+
+
 def load_wiki_page_info(wiki_title,
                         prefix,
                         language,
@@ -65,38 +121,72 @@ def load_wiki_page_info(wiki_title,
     with subfolders for the output per language
 
     :rtype: tuple
-    :return: (success, reason, naf)
+    :return: (text, annotations, success, reason)
     """
+    return load_wiki_pages_info([(wiki_title, prefix, language)],
+                                wiki_folder,
+                                wiki_uri2relative_path)[0]
 
-    success = True
-    reason = 'success'
-    naf = None
 
-    assert language in {'nl', 'en', 'it'}, f'{language} not part of supported languages: nl it en'
+def load_wiki_pages_info(page_requests,
+                         wiki_folder,
+                         wiki_uri2relative_path,
+                         num_workers=1):
+    """
+    Load a batch of Wikipedia pages.
+    The requests are grouped by shard and sorted by line number,
+    such that every shard is read only once.
 
-    # try to retrieve JSON of Wikipedia article
-    wiki_uri = f'{prefix}{wiki_title.replace(" ", "_")}'
-    wiki_uri_encoded = urlencode_wikititle(wiki_title, prefix=prefix)
+    :param list page_requests: list of (wiki_title, prefix, language) tuples,
+    see function "load_wiki_page_info"
+    :param str wiki_folder: path to where extracted Wikipedia output is stored, e.g, the folder "wiki",
+    with subfolders for the output per language
+    :param dict wiki_uri2relative_path: Wikipedia uri -> (relative_path, line_number)
+    :param int num_workers: if larger than 1, the shards are divided over this number of worker processes,
+    each decompressing and parsing its own subset of shards
 
-    if wiki_uri_encoded not in wiki_uri2relative_path:
-        reason = 'page not extracted'
-        success = False
-        return None, None, success, reason
-    else:
-        relative_path, line_number = wiki_uri2relative_path[wiki_uri_encoded]
-        path = os.path.join(wiki_folder, relative_path)
+    :rtype: list
+    :return: list of (text, annotations, success, reason) tuples, one for each request (same order)
+    """
+    results = [None] * len(page_requests)
+    relative_path2line_number2indices = defaultdict(lambda: defaultdict(list))
+
+    for index, (wiki_title, prefix, language) in enumerate(page_requests):
+
+        assert language in {'nl', 'en', 'it'}, f'{language} not part of supported languages: nl it en'
+
+        # try to retrieve JSON of Wikipedia article
+        wiki_uri_encoded = urlencode_wikititle(wiki_title, prefix=prefix)
 
-        # load wiki_page
-        wiki_page = {}
-        with bz2.BZ2File(path, "r") as infile:
-            for index, line in enumerate(infile):
-                if index == line_number:
-                    wiki_page = json.loads(line)
-                    break
+        if wiki_uri_encoded not in wiki_uri2relative_path:
+            results[index] = (None, None, False, 'page not extracted')
+        else:
+            relative_path, line_number = wiki_uri2relative_path[wiki_uri_encoded]
+            relative_path2line_number2indices[relative_path][line_number].append(index)
+
+    shard_requests = [(relative_path, sorted(relative_path2line_number2indices[relative_path]))
+                      for relative_path in sorted(relative_path2line_number2indices)]
+
+    if num_workers > 1 and len(shard_requests) > 1:
+        num_workers = min(num_workers, len(shard_requests))
+        worker_tasks = [(wiki_folder, shard_requests[worker_index::num_workers])
+                        for worker_index in range(num_workers)]
+        path_info2page = {}
+        with multiprocessing.get_context(mp_start_method).Pool(num_workers) as pool:
+            for worker_path_info2page in pool.starmap(load_pages_of_shards, worker_tasks):
+                path_info2page.update(worker_path_info2page)
+    else:
+        path_info2page = load_pages_of_shards(wiki_folder, shard_requests)
 
-        assert wiki_page, f'index is wrong for {language} {wiki_title}'
+    for relative_path, line_number2indices in relative_path2line_number2indices.items():
+        for line_number, indices in line_number2indices.items():
+            for index in indices:
+                wiki_title, prefix, language = page_requests[index]
+                wiki_page = path_info2page.get((relative_path, line_number))
+                assert wiki_page, f'index is wrong for {language} {wiki_title}'
+                results[index] = (wiki_page['text'], wiki_page['annotations'], True, 'success')
 
-        return wiki_page['text'], wiki_page['annotations'], success, reason
+    return results
 
 if __name__ == '__main__':
     import spacy
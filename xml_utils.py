@@ -3,6 +3,7 @@ import os
 import pickle
 from lxml import etree
 import inspect
+import threading
 
 import utils
 import native_api_utils
@@ -314,6 +315,38 @@ def iterable_of_lexical_items(doc,
         the_value = '--'.join(values)
         yield the_value
 
+naf_path2owner = {} # NAF path -> owner that writes and enriches it in this run (see function "claim_naf_path")
+naf_paths_lock = threading.Lock()
+
+
+def claim_naf_path(naf_path, owner):
+    """
+    Claim a NAF file for an owner, e.g., an event type, such that event types that are processed at the same time
+    do not write or enrich the same NAF file (same Wikipedia page and language).
+    The first owner that claims a NAF file keeps it during the run.
+
+    :rtype: bool
+    :return: whether the NAF file is claimed by this owner
+    """
+    with naf_paths_lock:
+        return naf_path2owner.setdefault(naf_path, owner) == owner
+
+
+def remove_unclaimed_naf_file(naf_path, owner):
+    """
+    Remove a NAF file, unless it has been claimed by another owner in this run (see function "claim_naf_path").
+    The file is not claimed, hence another owner can still write it afterwards.
+
+    :rtype: bool
+    :return: whether the NAF file was removed
+    """
+    with naf_paths_lock:
+        if naf_path2owner.get(naf_path, owner) != owner or not os.path.exists(naf_path):
+            return False
+        os.remove(naf_path)
+        return True
+
+
 def get_naf_paths(inc_coll_obj,
                   main_naf_folder,
                   verbose=0):
@@ -546,16 +579,20 @@ def add_coreferences_layer(naf_path,
 def add_wikidata_uris_to_naf_files(inc_coll_obj,
                                    main_naf_folder,
                                    languages,
+                                   owner=None,
                                    verbose=0):
     """
 
     :param inc_coll_obj:
+    :param owner: if provided, only the NAF files claimed by this owner are enriched (see function "claim_naf_path")
     :return:
     """
     # get NAF paths
     naf_paths, naf_to_inc_id = get_naf_paths(inc_coll_obj,
                                              main_naf_folder,
                                              verbose=verbose)
+    if owner is not None:
+        naf_paths = {naf_path for naf_path in naf_paths if claim_naf_path(naf_path, owner)}
 
     # get uris
     uri_to_rels, inc_id_to_wd_uris = utils.get_uris(inc_coll_obj,